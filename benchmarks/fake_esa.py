@@ -0,0 +1,218 @@
+"""A local stand-in for the esa API and the S3 upload endpoint.
+
+Implements just enough of `oauth/token`, `v1/teams/{team}/attachments/policies`
+and the S3 form POST for esap to upload attachments. Every response can be
+delayed by a fixed latency, request bodies can be read at a limited bandwidth
+per connection and a share of the requests can fail with 503 to exercise
+retries. Point a client at it with `endpoint_base`; plain HTTP also needs
+`OAUTHLIB_INSECURE_TRANSPORT=1`.
+
+Usage:
+  python benchmarks/fake_esa.py [--port N] [--latency S] [--bandwidth B/S]
+                                [--error-rate P]
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import dataclasses
+import datetime
+import http.server
+import itertools
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+from typing import Union
+
+_POLICIES_PATH = re.compile(r'/v1/teams/[^/]+/attachments/policies')
+_S3_PATH = '/s3'
+_CHUNK_SIZE = 64 * 1024
+
+
+@dataclasses.dataclass
+class FakeEsaOptions:
+  # Seconds added to every response.
+  latency: float = 0.0
+  # Bytes per second at which each connection reads request bodies.
+  bandwidth: Union[float, None] = None
+  # Probability that a policies or S3 request fails with 503.
+  error_rate: float = 0.0
+  # Lifetime of the upload policies handed out.
+  policy_ttl: float = 3600.0
+  # If set, policies requests with another bearer token fail with 401.
+  access_token: Union[str, None] = None
+  seed: Union[int, None] = None
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True
+
+  # Set on the subclass created by `make_server`.
+  options: FakeEsaOptions
+  rng: random.Random
+  rng_lock: threading.Lock
+  upload_ids: itertools.count
+
+  def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+    pass
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    body = self._read_body()
+    if self.options.latency:
+      time.sleep(self.options.latency)
+    path = self.path.split('?', 1)[0]
+    if path == '/oauth/token':
+      self._send_json(
+          200, {
+              'access_token': 'fake-access-token',
+              'token_type': 'Bearer',
+              'expires_in': 7200,
+              'refresh_token': 'fake-refresh-token',
+              'scope': 'read write',
+          })
+    elif _POLICIES_PATH.fullmatch(path):
+      if not self._reject_token() and not self._inject_error():
+        self._send_policies(json.loads(body))
+    elif path == _S3_PATH:
+      if not self._inject_error():
+        upload_id = next(self.upload_ids)
+        self._send(204, b'', {
+            'Location': f'https://files.example.com/uploads/{upload_id}',
+        })
+    else:
+      self._send_json(404, {'error': 'not_found', 'message': 'Not found'})
+
+  def _read_body(self) -> bytes:
+    length = int(self.headers.get('Content-Length', 0))
+    if self.path != _S3_PATH:
+      return self.rfile.read(length)
+    # Attachments are read in chunks and dropped, paced to the bandwidth.
+    start = time.monotonic()
+    received = 0
+    while received < length:
+      chunk = self.rfile.read(min(_CHUNK_SIZE, length - received))
+      if not chunk:
+        break
+      received += len(chunk)
+      if self.options.bandwidth:
+        delay = start + received / self.options.bandwidth - time.monotonic()
+        if delay > 0:
+          time.sleep(delay)
+    return b''
+
+  def _reject_token(self) -> bool:
+    expected = self.options.access_token
+    if (expected is None or
+        self.headers.get('Authorization') == f'Bearer {expected}'):
+      return False
+    self._send_json(401, {
+        'error': 'unauthorized',
+        'message': 'Invalid access token'
+    })
+    return True
+
+  def _inject_error(self) -> bool:
+    with self.rng_lock:
+      failed = self.rng.random() < self.options.error_rate
+    if failed:
+      self._send_json(503, {
+          'error': 'service_unavailable',
+          'message': 'Injected failure'
+      })
+    return failed
+
+  def _send_policies(self, params: dict):
+    expiration = (datetime.datetime.utcnow() +
+                  datetime.timedelta(seconds=self.options.policy_ttl))
+    policy = json.dumps({
+        'expiration': expiration.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+    })
+    host = self.headers['Host']
+    self._send_json(
+        201, {
+            'attachment': {
+                'endpoint': f'http://{host}{_S3_PATH}',
+                'url': f'https://files.example.com/uploads/{params["name"]}',
+            },
+            'form': {
+                'AWSAccessKeyId': 'fake-access-key-id',
+                'signature': 'fake-signature',
+                'policy': base64.b64encode(policy.encode('utf-8')).decode(),
+                'key': 'uploads/${filename}',
+                'Content-Type': params['type'],
+                'Cache-Control': 'max-age=31536000',
+                'acl': 'public-read',
+            },
+        })
+
+  def _send_json(self, status: int, body: dict):
+    self._send(status,
+               json.dumps(body).encode('utf-8'),
+               {'Content-Type': 'application/json; charset=utf-8'})
+
+  def _send(self, status: int, content: bytes, headers: dict[str, str]):
+    self.send_response(status)
+    for key, value in headers.items():
+      self.send_header(key, value)
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+
+def make_server(options: FakeEsaOptions,
+                host: str = '127.0.0.1',
+                port: int = 0) -> http.server.ThreadingHTTPServer:
+  handler = type(
+      'Handler', (_Handler,), {
+          'options': options,
+          'rng': random.Random(options.seed),
+          'rng_lock': threading.Lock(),
+          'upload_ids': itertools.count(1),
+      })
+  server = http.server.ThreadingHTTPServer((host, port), handler)
+  server.daemon_threads = True
+  return server
+
+
+def _serve(options: FakeEsaOptions, connection):
+  server = make_server(options)
+  connection.send(server.server_address[1])
+  server.serve_forever()
+
+
+def start_in_process(
+    options: FakeEsaOptions) -> tuple[multiprocessing.Process, str]:
+  """Runs a server in a child process, away from the measured process.
+
+  Returns the process and the endpoint base of the server.
+  """
+  context = multiprocessing.get_context('spawn')
+  receiver, sender = context.Pipe(duplex=False)
+  process = context.Process(target=_serve, args=(options, sender), daemon=True)
+  process.start()
+  port = receiver.recv()
+  return process, f'http://127.0.0.1:{port}/'
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--port', type=int, default=8000)
+  parser.add_argument('--latency', type=float, default=0.0)
+  parser.add_argument('--bandwidth', type=float, default=None)
+  parser.add_argument('--error-rate', type=float, default=0.0)
+  args = parser.parse_args()
+
+  server = make_server(FakeEsaOptions(latency=args.latency,
+                                      bandwidth=args.bandwidth,
+                                      error_rate=args.error_rate),
+                       port=args.port)
+  print(f'Serving on http://127.0.0.1:{server.server_address[1]}/')
+  server.serve_forever()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,75 @@
+"""Guards the startup budget of `import esap`.
+
+Imports esap in fresh interpreters, reports the median import time and fails
+if it exceeds the budget or if a heavy dependency is imported eagerly.
+
+Usage:
+  python benchmarks/import_time.py [--runs N] [--budget-ms MS]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Modules that must only be imported when they are actually used.
+DEFERRED_MODULES = [
+    'asyncio',
+    'httplib2',
+    'lxml',
+    'oauthlib',
+    'pandas',
+    'tqdm',
+]
+
+_PROBE = """
+import json
+import sys
+import time
+
+start = time.perf_counter()
+import esap
+elapsed = time.perf_counter() - start
+print(json.dumps({
+    'seconds': elapsed,
+    'modules': sorted(m for m in %r if m in sys.modules),
+}))
+""" % (DEFERRED_MODULES,)
+
+
+def _measure_once(package_root: str) -> dict:
+  env = dict(os.environ)
+  env['PYTHONPATH'] = os.pathsep.join(
+      filter(None, [package_root, env.get('PYTHONPATH')]))
+  output = subprocess.check_output([sys.executable, '-c', _PROBE], env=env)
+  return json.loads(output)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--runs', type=int, default=10)
+  parser.add_argument('--budget-ms', type=float, default=150.0)
+  args = parser.parse_args()
+
+  package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  results = [_measure_once(package_root) for _ in range(args.runs)]
+  median_ms = statistics.median(r['seconds'] for r in results) * 1000
+  eager_modules = sorted({m for r in results for m in r['modules']})
+
+  print(f'import esap: median {median_ms:.1f} ms over {args.runs} runs '
+        f'(budget {args.budget_ms:.0f} ms)')
+  failed = False
+  if median_ms > args.budget_ms:
+    print('FAIL: import time exceeds the budget')
+    failed = True
+  if eager_modules:
+    print(f'FAIL: imported eagerly: {", ".join(eager_modules)}')
+    failed = True
+  if failed:
+    sys.exit(1)
+  print('OK')
+
+
+if __name__ == '__main__':
+  main()
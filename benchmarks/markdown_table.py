@@ -0,0 +1,131 @@
+"""Compares the streaming table writer against `to_markdown` and minifying.
+
+Renders random DataFrames with both `table.write_markdown_table` and
+`table.minify_markdown_table(df.to_markdown())`, fails if any output differs,
+and then reports the time and peak memory of both on a large grid of
+attachment cells.
+
+Usage:
+  python benchmarks/markdown_table.py [--rows N] [--columns N] [--fuzz N]
+"""
+import argparse
+import datetime
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from esap.markdown import table  # pylint: disable=wrong-import-position
+
+_TEXTS = [
+    '', ' ', 'x', ' padded ', 'a|b', 'a | b', 'two\nlines', '1.50', '007',
+    '1e3', 'True', 'nan', 'inf', '-', '日本語', 'ｗｉｄｅ', 'é',
+    '<img alt="a.png" src="https://example.com/a.png">'
+]
+
+
+def _random_value(rng: random.Random, kind: str):
+  if kind == 'int':
+    return rng.choice([0, 7, -3, 42, 10**6, 123456789])
+  if kind == 'float':
+    return rng.choice(
+        [0.5, 1.25, -2.0, 3.14159265, 1e10, 1e-7, math.nan, math.inf])
+  if kind == 'bool':
+    return rng.choice([True, False])
+  if kind == 'none':
+    return None
+  if kind == 'bytes':
+    return rng.choice([b'abc', b'12', b'\xff'])
+  if kind == 'date':
+    return datetime.date(2023, 1, rng.randint(1, 28))
+  return rng.choice(_TEXTS)
+
+
+def _random_frame(rng: random.Random) -> pd.DataFrame:
+  num_rows = rng.randint(1, 6)
+  kinds = ['int', 'float', 'bool', 'none', 'bytes', 'date', 'text']
+  columns = {}
+  for j in range(rng.randint(1, 5)):
+    column_kinds = rng.sample(kinds, rng.randint(1, 2))
+    name = rng.choice([f'c{j}', j, f'long column {j}', f'列{j}', f' c{j} '])
+    columns[name] = [
+        _random_value(rng, rng.choice(column_kinds)) for _ in range(num_rows)
+    ]
+  df = pd.DataFrame(columns)
+  if rng.random() < 0.3:
+    df.index = [_random_value(rng, 'text') for _ in range(num_rows)]
+  elif rng.random() < 0.3:
+    df.index = pd.Index([10**rng.randint(0, 8) for _ in range(num_rows)])
+  if rng.random() < 0.3:
+    df.index.name = rng.choice(['idx', 'index name'])
+  return df
+
+
+def _grid(rows: int, columns: int) -> pd.DataFrame:
+  url = 'https://files.esa.io/uploads/production/attachments/1'
+  cells = [[
+      f'<img alt="{i}-{j}.png" src="{url}/{i}/{j}.png">' for j in range(columns)
+  ] for i in range(rows)]
+  return pd.DataFrame(cells, columns=[f'c{j}' for j in range(columns)])
+
+
+def _measure(render) -> tuple:
+  tracemalloc.start()
+  start = time.perf_counter()
+  render()
+  elapsed = time.perf_counter() - start
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  return elapsed, peak
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--rows', type=int, default=2000)
+  parser.add_argument('--columns', type=int, default=20)
+  parser.add_argument('--fuzz', type=int, default=2000)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  mismatches = []
+  for _ in range(args.fuzz):
+    df = _random_frame(rng)
+    try:
+      expected = table.minify_markdown_table(df.to_markdown())
+    except ValueError:
+      # Some mixed columns cannot be rendered by tabulate either.
+      continue
+    actual = table.write_markdown_table(df)
+    if actual != expected:
+      mismatches.append((df, expected, actual))
+
+  df = _grid(args.rows, args.columns)
+  output_size = len(table.write_markdown_table(df))
+  minify_time, minify_peak = _measure(
+      lambda: table.minify_markdown_table(df.to_markdown()))
+  write_time, write_peak = _measure(lambda: table.write_markdown_table(df))
+  print(f'{args.rows}x{args.columns} cells, '
+        f'{output_size / 2**20:.1f} MiB of markdown')
+  print(f'to_markdown + minify: {minify_time:.2f} s, '
+        f'peak {minify_peak / 2**20:.1f} MiB')
+  print(f'write_markdown_table: {write_time:.2f} s, '
+        f'peak {write_peak / 2**20:.1f} MiB')
+
+  if mismatches:
+    for df, expected, actual in mismatches[:5]:
+      print(f'MISMATCH\n{df!r}\n  expected: {expected!r}\n'
+            f'  actual:   {actual!r}')
+    print(f'FAIL: {len(mismatches)} of {args.fuzz} tables differ')
+    sys.exit(1)
+  print('OK')
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,122 @@
+"""Compares attachment rendering against the lxml-based reference.
+
+Renders the same cells with `esap.markdown.embedding.render` and with lxml
+element construction and serialization, fails if any output differs and
+reports the time per cell of both. Requires lxml (see requirements-dev.txt).
+
+Usage:
+  python benchmarks/render.py [--cells N] [--fuzz N] [--seed SEED]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import types
+
+from lxml import html
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from esap.markdown import embedding  # pylint: disable=wrong-import-position
+
+_MIMETYPES = [
+    'image/png',
+    'image/jpeg',
+    'audio/mpeg',
+    'video/mp4',
+    'application/pdf',
+    'text/csv',
+]
+
+# Characters that exercise quoting, entity escaping, percent-encoding and
+# character references.
+_ALPHABET = ('abcXYZ019 -_.~!*\'()@/:=?;#%&,+<>"`{}[]|\\^\t\n\r\x7f\x85'
+             'é日本語😀\u2028')
+
+
+def _lxml_to_string(element) -> str:
+  return html.tostring(element).decode('utf-8')
+
+
+def render_with_lxml(file, url: str) -> str:
+  """The element-based renderer that `embedding.render` must match."""
+  mimetype = file.mimetype
+  if mimetype.startswith('image/'):
+    element = html.Element('img')
+  elif mimetype.startswith('audio/'):
+    element = html.Element('audio')
+    element.set('controls')
+  elif mimetype.startswith('video/'):
+    element = html.Element('video')
+    element.set('controls')
+  else:
+    element = html.Element('a')
+    element.set('href', url)
+    element.text = file.name
+    return _lxml_to_string(element)
+  element.set('alt', file.name)
+  element.set('src', url)
+  return _lxml_to_string(element)
+
+
+def _random_string(rng: random.Random, max_length: int) -> str:
+  return ''.join(
+      rng.choice(_ALPHABET) for _ in range(rng.randint(0, max_length)))
+
+
+def _make_cells(rng: random.Random, count: int, fuzz: bool) -> list:
+  cells = []
+  for i in range(count):
+    mimetype = rng.choice(_MIMETYPES)
+    if fuzz:
+      name = _random_string(rng, 12)
+      url = _random_string(rng, 24)
+    else:
+      name = f'screenshot {i}.png'
+      url = f'https://files.esa.io/uploads/production/attachments/1/{i}/x.png'
+    cells.append((types.SimpleNamespace(name=name, mimetype=mimetype), url))
+  return cells
+
+
+def _time_per_cell(render, cells: list) -> float:
+  start = time.perf_counter()
+  for file, url in cells:
+    render(file, url)
+  return (time.perf_counter() - start) / len(cells)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--cells', type=int, default=20000)
+  parser.add_argument('--fuzz', type=int, default=20000)
+  parser.add_argument('--seed', type=int, default=0)
+  args = parser.parse_args()
+
+  rng = random.Random(args.seed)
+  cells = _make_cells(rng, args.cells, fuzz=False)
+  fuzz_cells = _make_cells(rng, args.fuzz, fuzz=True)
+
+  mismatches = []
+  for file, url in cells + fuzz_cells:
+    expected = render_with_lxml(file, url)
+    actual = embedding.render(file, url)
+    if actual != expected:
+      mismatches.append((file.name, url, expected, actual))
+
+  lxml_us = _time_per_cell(render_with_lxml, cells) * 1e6
+  template_us = _time_per_cell(embedding.render, cells) * 1e6
+  print(f'lxml:     {lxml_us:.2f} us/cell')
+  print(f'template: {template_us:.2f} us/cell ({lxml_us / template_us:.1f}x)')
+
+  if mismatches:
+    for name, url, expected, actual in mismatches[:10]:
+      print(f'MISMATCH name={name!r} url={url!r}\n'
+            f'  lxml:     {expected!r}\n  template: {actual!r}')
+    print(f'FAIL: {len(mismatches)} outputs differ from lxml')
+    sys.exit(1)
+  print('OK')
+
+
+if __name__ == '__main__':
+  main()
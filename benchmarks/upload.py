@@ -0,0 +1,200 @@
+"""Measures upload throughput against a local stand-in for esa and S3.
+
+Starts the server of `fake_esa.py` in a child process and uploads synthetic
+grids of random files through `EsaClient` and
+`TeamService.upload_and_render_table`. Every combination of grid and file size
+runs in a fresh process with an empty attachment cache, and reports files/s,
+MB/s, the p50/p95 latency of the policies and S3 requests, the number of
+retries and the peak RSS of the uploading process.
+
+Usage:
+  python benchmarks/upload.py [--grids 10x10,40x25] [--file-sizes 16k,1m]
+                              [--workers N] [--latency S] [--bandwidth B/S]
+                              [--error-rate P] [--json]
+"""
+from __future__ import annotations
+
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import re
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import fake_esa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from esap import scheduler  # pylint: disable=wrong-import-position
+from esap import storage  # pylint: disable=wrong-import-position
+import esap  # pylint: disable=wrong-import-position
+
+_SIZE = re.compile(r'(\d+(?:\.\d+)?)([kmg]?)', re.IGNORECASE)
+_SIZE_UNITS = {'': 1, 'k': 2**10, 'm': 2**20, 'g': 2**30}
+
+
+def _parse_size(text: str) -> int:
+  match = _SIZE.fullmatch(text.strip())
+  if match is None:
+    raise argparse.ArgumentTypeError(f'invalid size: {text!r}')
+  return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).lower()])
+
+
+def _parse_grid(text: str) -> tuple[int, int]:
+  try:
+    rows, columns = (int(n) for n in text.lower().split('x'))
+  except ValueError as e:
+    raise argparse.ArgumentTypeError(f'invalid grid: {text!r}') from e
+  return rows, columns
+
+
+def _parse_list(parse):
+  return lambda text: [parse(item) for item in text.split(',')]
+
+
+class _TimingScheduler(scheduler.RequestScheduler):
+  """Records the latency of every request, including its retries."""
+
+  def __init__(self):
+    super().__init__()
+    self.latencies: dict[str, list[float]] = collections.defaultdict(list)
+    self._latencies_lock = threading.Lock()
+
+  def call(self, uri, send, idempotent=True):
+    start = time.perf_counter()
+    try:
+      return super().call(uri, send, idempotent=idempotent)
+    finally:
+      elapsed = time.perf_counter() - start
+      kind = 'policies' if uri.endswith('/attachments/policies') else 's3'
+      with self._latencies_lock:
+        self.latencies[kind].append(elapsed)
+
+
+def _percentile(values: list[float], percent: int) -> float:
+  if len(values) < 2:
+    return values[0] if values else float('nan')
+  return statistics.quantiles(values, n=100)[percent - 1]
+
+
+def _peak_rss() -> int:
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Kilobytes on Linux, bytes on macOS.
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_scenario(endpoint_base: str, rows: int, columns: int, file_size: int,
+                 workers: int) -> dict:
+  """Uploads a grid of new files and returns the measurements."""
+  import pandas as pd  # pylint: disable=import-outside-toplevel
+
+  with tempfile.TemporaryDirectory() as directory:
+    data = []
+    for i in range(rows):
+      row = []
+      for j in range(columns):
+        path = os.path.join(directory, f'{i}-{j}.png')
+        with open(path, 'wb') as f:
+          f.write(os.urandom(file_size))
+        row.append(esap.File(path))
+      data.append(row)
+    df = pd.DataFrame(data)
+
+    request_scheduler = _TimingScheduler()
+    options = esap.AuthOptions(
+        client_secrets_backend='in_memory',
+        client_secrets=esap.ClientSecrets('fake-client-id',
+                                          'fake-client-secret'),
+        credentials_backend='in_memory',
+        credentials=esap.Credentials(access_token='fake-access-token'))
+    client = esap.EsaClient(options,
+                            max_connections_per_host=workers,
+                            request_scheduler=request_scheduler,
+                            endpoint_base=endpoint_base)
+    team = client.team_service('benchmark',
+                               cache_storage=storage.InMemoryStorage({}))
+
+    start = time.perf_counter()
+    team.upload_and_render_table(df, max_workers=workers)
+    elapsed = time.perf_counter() - start
+
+  num_files = rows * columns
+  latencies = request_scheduler.latencies
+  return {
+      'grid': f'{rows}x{columns}',
+      'file_size': file_size,
+      'files': num_files,
+      'seconds': elapsed,
+      'files_per_second': num_files / elapsed,
+      'mb_per_second': num_files * file_size / elapsed / 1e6,
+      'policies_p50_ms': _percentile(latencies['policies'], 50) * 1000,
+      'policies_p95_ms': _percentile(latencies['policies'], 95) * 1000,
+      's3_p50_ms': _percentile(latencies['s3'], 50) * 1000,
+      's3_p95_ms': _percentile(latencies['s3'], 95) * 1000,
+      'retries': request_scheduler.stats['retry_status'],
+      'peak_rss_mib': _peak_rss() / 2**20,
+  }
+
+
+def _format_result(result: dict) -> str:
+  return (f'{result["grid"]:>7} x {result["file_size"] / 2**10:>7.0f} KiB: '
+          f'{result["files_per_second"]:7.1f} files/s '
+          f'{result["mb_per_second"]:7.2f} MB/s | '
+          f'policies p50 {result["policies_p50_ms"]:6.1f} ms '
+          f'p95 {result["policies_p95_ms"]:6.1f} ms | '
+          f's3 p50 {result["s3_p50_ms"]:6.1f} ms '
+          f'p95 {result["s3_p95_ms"]:6.1f} ms | '
+          f'retries {result["retries"]:3d} | '
+          f'peak RSS {result["peak_rss_mib"]:6.1f} MiB')
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--grids',
+                      type=_parse_list(_parse_grid),
+                      default=[(10, 10), (40, 25)])
+  parser.add_argument('--file-sizes',
+                      type=_parse_list(_parse_size),
+                      default=[16 * 2**10, 2**20])
+  parser.add_argument('--workers', type=int, default=8)
+  parser.add_argument('--latency', type=float, default=0.02)
+  parser.add_argument('--bandwidth', type=_parse_size, default=None)
+  parser.add_argument('--error-rate', type=float, default=0.0)
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--json',
+                      action='store_true',
+                      help='print one JSON object per scenario')
+  args = parser.parse_args()
+
+  # The stand-in speaks plain HTTP, which oauthlib refuses by default.
+  os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+  server, endpoint_base = fake_esa.start_in_process(
+      fake_esa.FakeEsaOptions(latency=args.latency,
+                              bandwidth=args.bandwidth,
+                              error_rate=args.error_rate,
+                              seed=args.seed))
+  context = multiprocessing.get_context('spawn')
+  try:
+    for rows, columns in args.grids:
+      for file_size in args.file_sizes:
+        # A fresh process per scenario, so that the peak RSS is its own.
+        with context.Pool(1) as pool:
+          result = pool.apply(
+              run_scenario,
+              (endpoint_base, rows, columns, file_size, args.workers))
+        print(json.dumps(result) if args.json else _format_result(result),
+              flush=True)
+  finally:
+    server.terminate()
+    server.join()
+
+
+if __name__ == '__main__':
+  main()
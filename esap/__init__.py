@@ -1,3 +1,5 @@
+import importlib
+
 from esap import markdown
 from esap.auth import AuthOptions
 from esap.auth import ClientSecrets
@@ -5,6 +7,24 @@ from esap.auth import Credentials
 from esap.base import BaseClient
 from esap.client import EsaClient
 from esap.errors import HttpError
+from esap.grid import grid_from_glob
+from esap.http_cache import ResponseCache
 from esap.resources import File
+from esap.resources import hash_files
 from esap.services.base import Service
 from esap.services.team import TeamService
+
+# These pull in asyncio, so they are imported on first access.
+_LAZY_ATTRIBUTES = {
+    'AsyncEsaClient': 'esap.async_client',
+    'AsyncTeamService': 'esap.services.async_team',
+}
+
+
+def __getattr__(name: str):
+  if name in _LAZY_ATTRIBUTES:
+    module = importlib.import_module(_LAZY_ATTRIBUTES[name])
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
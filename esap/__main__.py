@@ -0,0 +1,6 @@
+import sys
+
+from esap import cli
+
+if __name__ == '__main__':
+  sys.exit(cli.main())
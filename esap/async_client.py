@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+from typing import TYPE_CHECKING, Union
+
+from esap import async_transport
+from esap import auth
+from esap import base
+from esap import client
+from esap import metrics
+from esap import resources
+from esap import scheduler
+from esap import storage
+from esap.services import async_team
+
+if TYPE_CHECKING:
+  from esap import images
+
+
+class AsyncEsaClient(base.BaseClient):
+  """An asyncio counterpart of `EsaClient`.
+
+  Every HTTP request made through this client, including the S3 uploads of
+  its team services, waits on a semaphore that allows at most
+  `max_concurrency` requests in flight. Requests go directly to esa and S3;
+  proxy settings such as `HTTPS_PROXY` are not honored.
+  """
+
+  def __init__(self,
+               options: Union[auth.AuthOptions, None] = None,
+               max_concurrency: int = 16,
+               timeout: Union[float, None] = None,
+               request_scheduler: Union[scheduler.RequestScheduler,
+                                        None] = None,
+               endpoint_base: Union[str, None] = None,
+               instrumentation: Union[metrics.Instrumentation, None] = None):
+    if request_scheduler is None:
+      request_scheduler = scheduler.RequestScheduler()
+    self.request_scheduler = request_scheduler
+    self.endpoint_base = endpoint_base
+    self.auth = auth.Auth(options, endpoint_base=endpoint_base)
+    if instrumentation is None:
+      instrumentation = metrics.Instrumentation()
+    self.instrumentation = instrumentation
+    self.auth.authorize()
+    self.max_concurrency = max_concurrency
+    self.timeout = timeout
+    self._semaphore: Union[asyncio.Semaphore, None] = None
+
+  @property
+  def semaphore(self) -> asyncio.Semaphore:
+    # Created lazily so that it binds to the running event loop.
+    if self._semaphore is None:
+      self._semaphore = asyncio.Semaphore(self.max_concurrency)
+    return self._semaphore
+
+  def team_service(self,
+                   team_name: str,
+                   cache_storage: Union[storage.BaseStorage, None] = None,
+                   image_optimizer: Union[images.ImageOptimizer, None] = None,
+                   hash_algorithm: str = resources.HASH_ALGORITHM):
+    return async_team.AsyncTeamService(self,
+                                       team_name,
+                                       cache_storage=cache_storage,
+                                       image_optimizer=image_optimizer,
+                                       hash_algorithm=hash_algorithm)
+
+  async def get_request(self, endpoint: str, query_params=None, headers=None):
+    return await self._send_request(endpoint,
+                                    'GET',
+                                    query_params=query_params,
+                                    headers=headers)
+
+  async def post_request(self,
+                         endpoint: str,
+                         body=None,
+                         headers=None,
+                         idempotent: Union[bool, None] = None):
+    return await self._send_request(endpoint,
+                                    'POST',
+                                    body=body,
+                                    headers=headers,
+                                    idempotent=idempotent)
+
+  async def patch_request(self, endpoint: str, body=None, headers=None):
+    return await self._send_request(endpoint,
+                                    'PATCH',
+                                    body=body,
+                                    headers=headers)
+
+  async def request(self,
+                    uri: str,
+                    method: str,
+                    body=None,
+                    headers=None,
+                    idempotent: Union[bool, None] = None):
+    """Sends a request. `idempotent` is derived from `method` by default."""
+    if idempotent is None:
+      idempotent = method in scheduler.IDEMPOTENT_METHODS
+
+    async def send():
+      async with self.semaphore:
+        return await async_transport.request(uri,
+                                             method,
+                                             body=body,
+                                             headers=headers,
+                                             timeout=self.timeout)
+
+    return await self.request_scheduler.call_async(uri,
+                                                   send,
+                                                   idempotent=idempotent)
+
+  async def _send_request(self,
+                          endpoint: str,
+                          method: str,
+                          query_params=None,
+                          body=None,
+                          headers=None,
+                          idempotent: Union[bool, None] = None):
+    # A rejected token is refreshed and the request is sent once more.
+    for attempt in range(2):
+      access_token = self.auth.access_token
+      uri, request_headers, request_body = await self._prepare_request(
+          endpoint, method, query_params, body, headers)
+
+      with self.instrumentation.span(metrics.PHASE_REQUEST,
+                                     target=endpoint) as span:
+        response, content = await self.request(uri,
+                                               method,
+                                               request_body,
+                                               request_headers,
+                                               idempotent=idempotent)
+        span.status = response.status
+
+      if response.status != 401 or attempt > 0:
+        break
+      # The refresh is a synchronous request, so it runs in an executor.
+      if not await asyncio.get_running_loop().run_in_executor(
+          None, self.auth.refresh_rejected_token, access_token):
+        break
+
+    return client.parse_response(uri, response, content)
+
+  async def _prepare_request(self, endpoint: str, method: str, query_params,
+                             body, headers):
+    # Adding the token refreshes it first if it is about to expire, which
+    # blocks on a synchronous request.
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None,
+        functools.partial(client.prepare_request,
+                          self.auth,
+                          endpoint,
+                          method,
+                          query_params=query_params,
+                          body=body,
+                          headers=headers,
+                          endpoint_base=self.endpoint_base))
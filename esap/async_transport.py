@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import asyncio
+import ssl
+from typing import Iterable, Union
+import urllib.parse
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class Response(dict):
+  """Response headers with lowercase keys, like `httplib2.Response`."""
+
+  def __init__(self, status: int, reason: str, headers: dict[str, str]):
+    super().__init__(headers)
+    self.status = status
+    self.reason = reason
+    self['status'] = str(status)
+
+
+async def _read_headers(reader: asyncio.StreamReader) -> dict[str, str]:
+  headers = {}
+  while True:
+    line = await reader.readline()
+    if line in (b'\r\n', b'\n', b''):
+      return headers
+    key, value = line.decode('latin-1').split(':', 1)
+    key = key.strip().lower()
+    value = value.strip()
+    if key in headers:
+      value = f'{headers[key]}, {value}'
+    headers[key] = value
+
+
+async def _read_chunked(reader: asyncio.StreamReader) -> bytes:
+  chunks = []
+  while True:
+    size_line = await reader.readline()
+    size = int(size_line.split(b';', 1)[0].strip(), 16)
+    if size == 0:
+      # Skip trailers.
+      await _read_headers(reader)
+      return b''.join(chunks)
+    chunks.append(await reader.readexactly(size))
+    await reader.readexactly(2)
+
+
+async def _read_body(reader: asyncio.StreamReader, method: str, status: int,
+                     headers: dict[str, str]) -> bytes:
+  if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+    return b''
+  if 'chunked' in headers.get('transfer-encoding', '').lower():
+    return await _read_chunked(reader)
+  if 'content-length' in headers:
+    return await reader.readexactly(int(headers['content-length']))
+  return await reader.read()
+
+
+async def _write_body(writer: asyncio.StreamWriter,
+                      body: Union[bytes, Iterable[bytes], None]):
+  if body is None:
+    return
+  if isinstance(body, bytes):
+    writer.write(body)
+    await writer.drain()
+    return
+  # The chunks of a multipart body are read from disk, so read them in an
+  # executor to keep the event loop responsive.
+  loop = asyncio.get_running_loop()
+  chunks = iter(body)
+  while True:
+    chunk = await loop.run_in_executor(None, next, chunks, None)
+    if chunk is None:
+      return
+    writer.write(chunk)
+    await writer.drain()
+
+
+async def request(uri: str,
+                  method: str = 'GET',
+                  body: Union[str, bytes, Iterable[bytes], None] = None,
+                  headers: Union[dict[str, str], None] = None,
+                  timeout: Union[float, None] = None) -> tuple[Response, bytes]:
+  """Sends a single request and returns the response and its content.
+
+  `body` may be a string, bytes or an iterable of byte chunks. In the latter
+  case, `headers` must carry a Content-Length.
+
+  Unlike the httplib2 transport of `EsaClient`, proxy settings such as
+  `HTTPS_PROXY` are ignored and the host of `uri` is always connected to
+  directly.
+  """
+  return await asyncio.wait_for(_request(uri, method, body, headers),
+                                timeout=timeout)
+
+
+async def _request(uri: str, method: str, body, headers):
+  parsed = urllib.parse.urlsplit(uri)
+  if parsed.scheme not in _DEFAULT_PORTS:
+    raise ValueError(f'Unsupported URI scheme: {uri}')
+  host = parsed.hostname
+  port = parsed.port or _DEFAULT_PORTS[parsed.scheme]
+  ssl_context = None
+  if parsed.scheme == 'https':
+    ssl_context = ssl.create_default_context()
+
+  path = parsed.path or '/'
+  if parsed.query:
+    path += '?' + parsed.query
+
+  if isinstance(body, str):
+    body = body.encode('utf-8')
+
+  request_headers = {
+      'Host': parsed.netloc,
+      'Accept-Encoding': 'identity',
+      'Connection': 'close',
+  }
+  if isinstance(body, bytes):
+    request_headers['Content-Length'] = str(len(body))
+  request_headers.update(headers or {})
+
+  reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context)
+  try:
+    head = [f'{method} {path} HTTP/1.1']
+    head.extend(f'{key}: {value}' for key, value in request_headers.items())
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+    await _write_body(writer, body)
+
+    while True:
+      status_line = await reader.readline()
+      if not status_line:
+        raise ConnectionError(f'Connection closed by server: {uri}')
+      _, status, *reason = status_line.decode('latin-1').split(None, 2)
+      status = int(status)
+      response_headers = await _read_headers(reader)
+      # Skip informational responses such as `100 Continue`.
+      if status >= 200:
+        break
+
+    content = await _read_body(reader, method, status, response_headers)
+    reason = reason[0].strip() if reason else ''
+    return Response(status, reason, response_headers), content
+  finally:
+    writer.close()
+    try:
+      await writer.wait_closed()
+    except (ConnectionError, ssl.SSLError):
+      pass
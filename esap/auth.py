@@ -2,17 +2,36 @@ from __future__ import annotations
 
 import dataclasses
 import getpass
-from typing import Literal, Union
-
-import httplib2
+import logging
+import os
+import threading
+import time
+from typing import Literal, TYPE_CHECKING, Union
 
 from esap import errors
-from esap import oauth2
 from esap import storage
+from esap import transport
+
+if TYPE_CHECKING:
+  from esap import oauth2
+
+_logger = logging.getLogger(__name__)
 
 ENDPOINT_BASE = 'https://api.esa.io/'
 OOB_CALLBACK_URN = 'urn:ietf:wg:oauth:2.0:oob'
 
+# Access tokens are refreshed once they expire within this many seconds.
+TOKEN_REFRESH_MARGIN = 300.0
+# After a failed refresh, a token that is still valid is used for this many
+# seconds before the refresh is attempted again.
+TOKEN_REFRESH_RETRY_INTERVAL = 30.0
+
+# OAuth clients of file-backed credentials, keyed by the credentials file.
+# Every `Auth` in the process that reads the same file shares one client, so
+# a refreshed token is seen by all of them without reading the file again.
+_shared_clients: dict[str, oauth2.OAuth2Client] = {}
+_shared_clients_lock = threading.Lock()
+
 
 @dataclasses.dataclass
 class ClientSecrets:
@@ -75,16 +94,42 @@ def _load_credentials_storage(options: AuthOptions):
     raise ValueError('credentials_backend must be `file` or `in_memory`')
 
 
+def _create_client(options: AuthOptions) -> oauth2.OAuth2Client:
+  client_secrets = _load_client_secrets_storage(options)
+  credentials = _load_credentials_storage(options)
+  # oauthlib is slow to import, so load it only when it is needed.
+  from esap import oauth2  # pylint: disable=import-outside-toplevel
+
+  return oauth2.OAuth2Client(client_secrets,
+                             credentials,
+                             scope=['read', 'write'])
+
+
 class Auth(object):
 
-  def __init__(self, options: Union[AuthOptions, None] = None):
+  def __init__(self,
+               options: Union[AuthOptions, None] = None,
+               http: Union[transport.HttpPool, None] = None,
+               endpoint_base: Union[str, None] = None):
     if options is None:
       options = AuthOptions()
-    client_secrets = _load_client_secrets_storage(options)
-    credentials = _load_credentials_storage(options)
-    self.client = oauth2.OAuth2Client(client_secrets,
-                                      credentials,
-                                      scope=['read', 'write'])
+    if http is None:
+      http = transport.HttpPool()
+    self.http = http
+    self.endpoint_base = endpoint_base
+    self._refresh_retry_at = 0.0
+    if options.credentials_backend == 'file':
+      key = os.path.abspath(os.path.expanduser(options.credentials_file))
+      with _shared_clients_lock:
+        if key not in _shared_clients:
+          _shared_clients[key] = _create_client(options)
+        self.client = _shared_clients[key]
+    else:
+      self.client = _create_client(options)
+
+  @property
+  def access_token(self) -> Union[str, None]:
+    return self.client.access_token
 
   def authorize(self):
     if self.client.access_token is None:
@@ -99,13 +144,60 @@ class Auth(object):
       body: Union[str, None] = None,
       headers: Union[dict[str, str], None] = None
   ) -> tuple[str, dict[str, str], Union[str, None]]:
+    self._refresh_if_expiring()
     return self.client.add_token(uri,
                                  http_method=method,
                                  body=body,
                                  headers=headers)
 
+  def refresh_rejected_token(self, rejected_token: Union[str, None]) -> bool:
+    """Replaces an access token that the server rejected as invalid.
+
+    Returns whether the request should be sent again with the current token,
+    which is the case if the token has been refreshed, possibly by another
+    request in the meantime.
+    """
+    with self.client.refresh_lock:
+      if self.client.access_token != rejected_token:
+        return True
+      if self.client.refresh_token is None:
+        return False
+      self._refresh_access_token()
+      return True
+
+  def _refresh_if_expiring(self):
+    if not self._is_expiring():
+      return
+    with self.client.refresh_lock:
+      # Another request may have refreshed the token while this one waited.
+      if not self._is_expiring():
+        return
+      try:
+        self._refresh_access_token()
+      except (errors.HttpError, OSError) as e:
+        if self.client.expires_at <= time.time():
+          raise
+        # The token still works; keep using it and try again later.
+        _logger.warning('Failed to refresh the access token: %r', e)
+        self._refresh_retry_at = time.time() + TOKEN_REFRESH_RETRY_INTERVAL
+
+  def _is_expiring(self) -> bool:
+    expires_at = self.client.expires_at
+    if expires_at is None or self.client.refresh_token is None:
+      return False
+    now = time.time()
+    if now < self._refresh_retry_at and now < expires_at:
+      return False
+    return expires_at - TOKEN_REFRESH_MARGIN < now
+
+  def _refresh_access_token(self):
+    uri, headers, body = self.client.prepare_refresh_token_request(
+        self._build_uri('oauth/token'))
+    resp_content = self._send_auth_request(uri, headers, body)
+    self.client.parse_request_body_response(resp_content)
+
   def _build_uri(self, endpoint: str):
-    return ENDPOINT_BASE + endpoint
+    return (self.endpoint_base or ENDPOINT_BASE) + endpoint
 
   def _get_authorization_code(self):
     uri, _, _ = self.client.prepare_authorization_request(
@@ -118,8 +210,10 @@ class Auth(object):
     self.client.set_code(code)
 
   def _send_auth_request(self, uri: str, headers=None, body=None):
-    http = httplib2.Http()
-    response, content = http.request(uri, 'POST', body=body, headers=headers)
+    response, content = self.http.request(uri,
+                                          'POST',
+                                          body=body,
+                                          headers=headers)
     if response.status != 200:
       raise errors.HttpError(response, content, uri=uri)
     return content
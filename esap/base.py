@@ -1,10 +1,24 @@
 import abc
+from typing import Union
 
 
 class BaseClient(abc.ABC):
 
+  # Connection pool shared with the services of this client, if any.
+  http = None
+
+  # `metrics.Instrumentation` shared with the services of this client, if any.
+  instrumentation = None
+
   def get_request(self, endpoint: str, query_params=None, headers=None):
     pass
 
-  def post_request(self, endpoint: str, body=None, headers=None):
+  def post_request(self,
+                   endpoint: str,
+                   body=None,
+                   headers=None,
+                   idempotent: Union[bool, None] = None):
+    """Sends a POST request. Set `idempotent` if it may be retried safely."""
+
+  def patch_request(self, endpoint: str, body=None, headers=None):
     pass
@@ -0,0 +1,295 @@
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Iterable, Iterator, Sequence, TextIO, Union
+
+from esap import client as client_lib
+from esap import errors
+from esap import metrics
+from esap import resources
+
+DEFAULT_WORKERS = 8
+DEFAULT_BATCH_SIZE = 500
+
+_STDIN_FORMATS = ('lines', 'csv', 'json')
+
+
+class _FileSpans(object):
+  """A hook that records when work on each file started and its cache result."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._started_at: dict[str, float] = {}
+    self._cache_hits: dict[str, bool] = {}
+
+  def __call__(self, span: metrics.Span):
+    if span.target is None or span.phase == metrics.PHASE_REQUEST:
+      return
+    with self._lock:
+      started_at = self._started_at.get(span.target, span.timestamp)
+      self._started_at[span.target] = min(started_at, span.timestamp)
+      if span.cache_hit is not None:
+        self._cache_hits[span.target] = span.cache_hit
+
+  def pop(self, path: str) -> tuple[float, bool]:
+    """Returns the seconds since work on `path` started and its cache result."""
+    with self._lock:
+      started_at = self._started_at.pop(path, None)
+      cache_hit = self._cache_hits.pop(path, False)
+    seconds = 0.0 if started_at is None else time.time() - started_at
+    return max(seconds, 0.0), cache_hit
+
+
+class _JsonLinesWriter(object):
+
+  def __init__(self, output: TextIO):
+    self._output = output
+    self._lock = threading.Lock()
+
+  def write(self, record: dict):
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with self._lock:
+      self._output.write(line)
+      self._output.flush()
+
+
+def _expand(pattern: str) -> list[str]:
+  pattern = os.path.expanduser(pattern)
+  if not glob.has_magic(pattern):
+    return [pattern]
+  paths = sorted(path for path in glob.glob(pattern, recursive=True)
+                 if os.path.isfile(path))
+  # Like a shell, keep a pattern that matches nothing, so that it is reported
+  # as a missing file while the other inputs are still uploaded.
+  return paths or [pattern]
+
+
+def _read_json_items(stream: TextIO) -> Iterator:
+  for line in stream:
+    line = line.strip()
+    if not line:
+      continue
+    if line.startswith('['):
+      # A single array, possibly spread over several lines.
+      yield from json.loads(line + stream.read())
+    else:
+      yield json.loads(line)
+
+
+def read_manifest(stream: TextIO, stdin_format: str) -> Iterator[str]:
+  """Yields the paths listed in `stream` as they are read.
+
+  `lines` takes a path or a glob per line. `csv` takes the `path` column, or
+  the first one, of a CSV file with a header. `json` takes JSON lines, or a
+  single JSON array, of paths or of objects with a `path`. A glob that matches
+  no file is yielded as is.
+  """
+  if stdin_format == 'lines':
+    for line in stream:
+      line = line.strip()
+      if line:
+        yield from _expand(line)
+  elif stdin_format == 'csv':
+    reader = csv.DictReader(stream)
+    for row in reader:
+      value = row.get('path', row[reader.fieldnames[0]])
+      if value:
+        yield from _expand(value)
+  elif stdin_format == 'json':
+    for item in _read_json_items(stream):
+      yield from _expand(item['path'] if isinstance(item, dict) else item)
+  else:
+    raise ValueError(f'Unsupported stdin format: {stdin_format}')
+
+
+def _iter_paths(args: argparse.Namespace) -> Iterator[str]:
+  if not args.files or args.files == ['-']:
+    return read_manifest(sys.stdin, args.stdin_format)
+  return itertools.chain.from_iterable(_expand(arg) for arg in args.files)
+
+
+def _batched(items: Iterable, size: int) -> Iterator[list]:
+  iterator = iter(items)
+  while True:
+    batch = list(itertools.islice(iterator, size))
+    if not batch:
+      return
+    yield batch
+
+
+def _create_client(args: argparse.Namespace) -> client_lib.EsaClient:
+  return client_lib.EsaClient(max_connections_per_host=args.workers,
+                              endpoint_base=args.endpoint_base)
+
+
+def _make_reporter(args: argparse.Namespace, spans: _FileSpans,
+                   writer: _JsonLinesWriter):
+
+  def report(file: resources.File, url: str):
+    seconds, cache_hit = spans.pop(file.path)
+    writer.write({
+        'path': file.path,
+        'hash': file.hash(args.hash_algorithm),
+        'url': url,
+        'cache_hit': cache_hit,
+        'seconds': round(seconds, 6),
+    })
+
+  return report
+
+
+def _write_failures(writer: _JsonLinesWriter, spans: _FileSpans,
+                    files: Sequence[resources.File],
+                    error: errors.BatchUploadError):
+  for i, exception in error.failures:
+    spans.pop(files[i].path)
+    writer.write({'path': files[i].path, 'error': repr(exception)})
+
+
+def upload(args: argparse.Namespace) -> int:
+  """Uploads files and writes a JSON line for each of them to stdout."""
+  client = _create_client(args)
+  spans = _FileSpans()
+  client.instrumentation.add_hook(spans)
+  team = client.team_service(args.team, hash_algorithm=args.hash_algorithm)
+  writer = _JsonLinesWriter(sys.stdout)
+  report = _make_reporter(args, spans, writer)
+
+  failed = False
+  # The input is read a batch at a time, so uploads start before it ends.
+  for paths in _batched(_iter_paths(args), args.batch_size):
+    files = []
+    for path in paths:
+      try:
+        files.append(resources.File(path))
+      except OSError as e:
+        writer.write({'path': path, 'error': repr(e)})
+        failed = True
+    try:
+      team.upload_attachments(files,
+                              force_upload=args.force,
+                              max_workers=args.workers,
+                              on_complete=report)
+    except errors.BatchUploadError as e:
+      _write_failures(writer, spans, files, e)
+      failed = True
+  return 1 if failed else 0
+
+
+def _read_table(source: str, hash_algorithm: str):
+  """Reads a table of files from a `grid_from_glob` pattern or a CSV file."""
+  import pandas as pd  # pylint: disable=import-outside-toplevel
+
+  from esap import grid  # pylint: disable=import-outside-toplevel
+
+  if source != '-' and not source.endswith('.csv'):
+    return grid.grid_from_glob(source, hash_algorithm=hash_algorithm)
+
+  # The first column names the rows; other non-empty cells are file paths.
+  df = pd.read_csv(sys.stdin if source == '-' else source,
+                   index_col=0,
+                   dtype=str,
+                   keep_default_na=False)
+  return df.applymap(lambda path: resources.File(path) if path else None)
+
+
+def table(args: argparse.Namespace) -> int:
+  """Uploads a table of files and writes it as markdown to stdout.
+
+  A JSON line is written to stderr for each uploaded file.
+  """
+  df = _read_table(args.source, args.hash_algorithm)
+  client = _create_client(args)
+  spans = _FileSpans()
+  client.instrumentation.add_hook(spans)
+  team = client.team_service(args.team, hash_algorithm=args.hash_algorithm)
+  writer = _JsonLinesWriter(sys.stderr)
+  try:
+    markdown = team.upload_and_render_table(df,
+                                            force_upload=args.force,
+                                            minify_markdown=not args.no_minify,
+                                            max_workers=args.workers,
+                                            journal=args.journal,
+                                            on_complete=_make_reporter(
+                                                args, spans, writer),
+                                            show_progress=False)
+  except errors.BatchUploadError as e:
+    for location, exception in e.failures:
+      writer.write({'cell': list(map(str, location)), 'error': repr(exception)})
+    return 1
+  sys.stdout.write(markdown + '\n')
+  return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+  parser = argparse.ArgumentParser(
+      prog='esap', description='Uploads files to esa in batches.')
+  common = argparse.ArgumentParser(add_help=False)
+  common.add_argument('--team',
+                      default=os.environ.get('ESAP_TEAM'),
+                      required='ESAP_TEAM' not in os.environ,
+                      help='the esa team (default: $ESAP_TEAM)')
+  common.add_argument('--workers',
+                      type=int,
+                      default=DEFAULT_WORKERS,
+                      help='files uploaded at a time')
+  common.add_argument('--force',
+                      action='store_true',
+                      help='upload files even if they are cached')
+  common.add_argument('--hash-algorithm', default=resources.HASH_ALGORITHM)
+  common.add_argument('--endpoint-base', default=None, help=argparse.SUPPRESS)
+  subparsers = parser.add_subparsers(dest='command', required=True)
+
+  upload_parser = subparsers.add_parser(
+      'upload',
+      parents=[common],
+      help='upload files and write a JSON line per file',
+      description=upload.__doc__)
+  upload_parser.add_argument(
+      'files',
+      nargs='*',
+      help='paths or globs; read from stdin if omitted or `-`')
+  upload_parser.add_argument('--stdin-format',
+                             choices=_STDIN_FORMATS,
+                             default='lines')
+  upload_parser.add_argument('--batch-size',
+                             type=int,
+                             default=DEFAULT_BATCH_SIZE,
+                             help='files read from the input per batch')
+  upload_parser.set_defaults(handler=upload)
+
+  table_parser = subparsers.add_parser(
+      'table',
+      parents=[common],
+      help='upload a table of files and write it as markdown',
+      description=table.__doc__.splitlines()[0])
+  table_parser.add_argument(
+      'source',
+      help=('a pattern such as `assets/{column}/{row}.png`, or a CSV file of '
+            'paths (`-` for stdin)'))
+  table_parser.add_argument('--journal',
+                            default=None,
+                            help='resume an interrupted table with this file')
+  table_parser.add_argument('--no-minify', action='store_true')
+  table_parser.set_defaults(handler=table)
+  return parser
+
+
+def main(argv: Union[Sequence[str], None] = None) -> int:
+  args = build_parser().parse_args(argv)
+  try:
+    resources.check_hash_algorithm(args.hash_algorithm)
+    return args.handler(args)
+  except (errors.Error, OSError, ValueError) as e:
+    print(f'esap: {e}', file=sys.stderr)
+    return 2
+  except KeyboardInterrupt:
+    return 130
@@ -1,72 +1,216 @@
+from __future__ import annotations
+
 import json
-from typing import Union
+from typing import Sequence, TYPE_CHECKING, Union
 import urllib.parse
 
-import httplib2
-
 from esap import auth
 from esap import base
 from esap import errors
+from esap import http_cache
+from esap import metrics
+from esap import resources
+from esap import scheduler
+from esap import storage
+from esap import transport
 from esap.services import team
 
+if TYPE_CHECKING:
+  from esap import images
+
 ENDPOINT_BASE = 'https://api.esa.io/'
 
 
+def _build_uri(endpoint: str,
+               query_params: Union[dict, None] = None,
+               endpoint_base: Union[str, None] = None):
+  uri = (endpoint_base or ENDPOINT_BASE) + endpoint
+  if query_params:
+    uri += '?' + urllib.parse.urlencode(query_params)
+  return uri
+
+
+def prepare_request(client_auth: auth.Auth,
+                    endpoint: str,
+                    method: str,
+                    query_params=None,
+                    body=None,
+                    headers=None,
+                    endpoint_base: Union[str, None] = None):
+  uri = _build_uri(endpoint, query_params, endpoint_base)
+
+  if body is not None:
+    body = json.dumps(body)
+
+  if headers is None:
+    headers = {}
+  headers.update({'Content-Type': 'application/json'})
+
+  return client_auth.add_token(uri, method=method, body=body, headers=headers)
+
+
+def parse_response(uri: str, response, content: bytes):
+  if response.status < 300:
+    if response.status == 204:
+      return {}
+    return json.loads(content.decode('utf-8'))
+  else:
+    raise errors.HttpError(response, content, uri=uri)
+
+
 class EsaClient(base.BaseClient):
 
-  def __init__(self, options: Union[auth.AuthOptions, None] = None):
-    self.auth = auth.Auth(options)
+  def __init__(self,
+               options: Union[auth.AuthOptions, None] = None,
+               max_connections_per_host: int = 16,
+               request_scheduler: Union[scheduler.RequestScheduler,
+                                        None] = None,
+               endpoint_base: Union[str, None] = None,
+               instrumentation: Union[metrics.Instrumentation, None] = None,
+               response_cache: Union[http_cache.ResponseCache, None] = None):
+    if request_scheduler is None:
+      request_scheduler = scheduler.RequestScheduler()
+    self.request_scheduler = request_scheduler
+    self.http = transport.HttpPool(max_connections_per_host,
+                                   request_scheduler=request_scheduler)
+    # The API root, e.g. a local stand-in for esa. `ENDPOINT_BASE` by default.
+    self.endpoint_base = endpoint_base
+    self.auth = auth.Auth(options, http=self.http, endpoint_base=endpoint_base)
+    if instrumentation is None:
+      instrumentation = metrics.Instrumentation()
+    self.instrumentation = instrumentation
+    # Serves unchanged GET responses; disabled by default.
+    self.response_cache = response_cache
     self.auth.authorize()
 
-  def team_service(self, team_name: str):
-    return team.TeamService(self, team_name)
-
-  def _build_uri(self, endpoint: str, query_params: Union[dict, None] = None):
-    uri = ENDPOINT_BASE + endpoint
-    if query_params:
-      uri += '?' + urllib.parse.urlencode(query_params)
-    return uri
+  def team_service(self,
+                   team_name: str,
+                   cache_storage: Union[storage.BaseStorage, None] = None,
+                   image_optimizer: Union[images.ImageOptimizer, None] = None,
+                   hash_algorithm: str = resources.HASH_ALGORITHM,
+                   post_storage: Union[storage.BaseStorage, None] = None):
+    return team.TeamService(self,
+                            team_name,
+                            cache_storage=cache_storage,
+                            image_optimizer=image_optimizer,
+                            hash_algorithm=hash_algorithm,
+                            post_storage=post_storage)
+
+  def upload_to_teams(
+      self,
+      team_names: Sequence[str],
+      files: Sequence[Union[str, resources.File]],
+      force_upload=False,
+      max_workers: Union[int, None] = None,
+      hash_workers: Union[int, None] = None,
+      cache_storage: Union[storage.BaseStorage, None] = None,
+      image_optimizer: Union[images.ImageOptimizer, None] = None,
+      hash_algorithm: str = resources.HASH_ALGORITHM) -> dict[str, list[str]]:
+    """Uploads `files` to every team in `team_names`.
+
+    See `team.upload_to_teams`, which shares the hashing of each file across
+    the teams.
+    """
+    services = [
+        self.team_service(team_name,
+                          cache_storage=cache_storage,
+                          hash_algorithm=hash_algorithm)
+        for team_name in team_names
+    ]
+    return team.upload_to_teams(services,
+                                files,
+                                force_upload=force_upload,
+                                max_workers=max_workers,
+                                hash_workers=hash_workers,
+                                image_optimizer=image_optimizer)
 
   def get_request(self, endpoint: str, query_params=None, headers=None):
+    if self.response_cache is not None:
+      return self._send_cached_request(endpoint, query_params, headers)
     return self._send_request(endpoint,
                               'GET',
                               query_params=query_params,
                               headers=headers)
 
-  def post_request(self, endpoint: str, body=None, headers=None):
-    return self._send_request(endpoint, 'POST', body=body, headers=headers)
+  def post_request(self,
+                   endpoint: str,
+                   body=None,
+                   headers=None,
+                   idempotent: Union[bool, None] = None):
+    return self._send_request(endpoint,
+                              'POST',
+                              body=body,
+                              headers=headers,
+                              idempotent=idempotent)
+
+  def patch_request(self, endpoint: str, body=None, headers=None):
+    return self._send_request(endpoint, 'PATCH', body=body, headers=headers)
+
+  def _send_cached_request(self, endpoint: str, query_params, headers):
+    uri = _build_uri(endpoint, query_params, self.endpoint_base)
+    cached = self.response_cache.lookup(uri)
+    if cached is not None:
+      if self.response_cache.is_fresh(endpoint, cached):
+        return json.loads(cached.content)
+      headers = {**(headers or {}), **cached.conditional_headers()}
+
+    uri, response, content = self._request(endpoint,
+                                           'GET',
+                                           query_params=query_params,
+                                           headers=headers)
+    if response.status == 304 and cached is not None:
+      self.response_cache.revalidate(uri, cached, response)
+      return json.loads(cached.content)
+    result = parse_response(uri, response, content)
+    self.response_cache.store(uri, response, content)
+    return result
 
   def _send_request(self,
                     endpoint: str,
                     method: str,
                     query_params=None,
                     body=None,
-                    headers=None):
-    uri = self._build_uri(endpoint, query_params)
-
-    if body is not None:
-      body = json.dumps(body)
-
-    if headers is None:
-      headers = {}
-    headers.update({'Content-Type': 'application/json'})
-
-    uri, headers, body = self.auth.add_token(uri,
-                                             method=method,
-                                             body=body,
-                                             headers=headers)
-
-    http = httplib2.Http()
-    response, content = http.request(
-        uri,
-        method,
-        body=body,
-        headers=headers,
-    )
-
-    if response.status < 300:
-      if response.status == 204:
-        return {}
-      return json.loads(content.decode('utf-8'))
-    else:
-      raise errors.HttpError(response, content, uri=uri)
+                    headers=None,
+                    idempotent: Union[bool, None] = None):
+    return parse_response(*self._request(endpoint,
+                                         method,
+                                         query_params=query_params,
+                                         body=body,
+                                         headers=headers,
+                                         idempotent=idempotent))
+
+  def _request(self,
+               endpoint: str,
+               method: str,
+               query_params=None,
+               body=None,
+               headers=None,
+               idempotent: Union[bool, None] = None):
+    # A rejected token is refreshed and the request is sent once more.
+    for attempt in range(2):
+      access_token = self.auth.access_token
+      uri, request_headers, request_body = prepare_request(
+          self.auth,
+          endpoint,
+          method,
+          query_params=query_params,
+          body=body,
+          headers=headers,
+          endpoint_base=self.endpoint_base)
+
+      with self.instrumentation.span(metrics.PHASE_REQUEST,
+                                     target=endpoint) as span:
+        response, content = self.http.request(
+            uri,
+            method,
+            body=request_body,
+            headers=request_headers,
+            idempotent=idempotent,
+        )
+        span.status = response.status
+
+      if (response.status != 401 or attempt > 0 or
+          not self.auth.refresh_rejected_token(access_token)):
+        break
+
+    return uri, response, content
@@ -1,3 +1,5 @@
+from __future__ import annotations
+
 import json
 
 
@@ -78,3 +80,40 @@ class AuthenticationError(Error):
     return f'<AuthenticationError {self.reason}>'
 
   __str__ = __repr__
+
+
+class BatchUploadError(Error):
+  """One or more uploads in a batch failed."""
+
+  def __init__(self, failures: list, results: list):
+    # `failures` is a list of `(location, exception)` pairs and `results`
+    # holds the URLs of the uploads that succeeded (None for failed ones).
+    self.failures = failures
+    self.results = results
+
+  def __repr__(self):
+    details = '; '.join(
+        f'{location}: {exception!r}' for location, exception in self.failures)
+    return (f'<BatchUploadError {len(self.failures)} of {len(self.results)} '
+            f'uploads failed. Details: "{details}">')
+
+  __str__ = __repr__
+
+
+class FanOutUploadError(Error):
+  """Uploads to one or more of the teams of a fan-out failed."""
+
+  def __init__(self, failures: dict[str, Exception], results: dict[str, list]):
+    # `failures` maps team names to the error of their batch, usually a
+    # `BatchUploadError`, and `results` holds the URLs of every team, with
+    # None for the uploads that failed.
+    self.failures = failures
+    self.results = results
+
+  def __repr__(self):
+    details = '; '.join(f'{team_name}: {exception!r}'
+                        for team_name, exception in self.failures.items())
+    return (f'<FanOutUploadError {len(self.failures)} of {len(self.results)} '
+            f'teams failed. Details: "{details}">')
+
+  __str__ = __repr__
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import concurrent.futures
+import os
+import re
+from typing import Any, Callable, TYPE_CHECKING, Union
+
+from esap import resources
+
+if TYPE_CHECKING:
+  import pandas as pd
+
+_PLACEHOLDER = re.compile(r'\{(row|column)\}')
+_WILDCARD = re.compile(r'[*?]')
+
+
+def _translate(segment: str) -> re.Pattern:
+  """Translates a path segment of a pattern into a regular expression."""
+  parts = []
+  pos = 0
+  for match in _PLACEHOLDER.finditer(segment):
+    parts.append(_translate_wildcards(segment[pos:match.start()]))
+    parts.append(f'(?P<{match.group(1)}>.+)')
+    pos = match.end()
+  parts.append(_translate_wildcards(segment[pos:]))
+  return re.compile(''.join(parts), re.DOTALL)
+
+
+def _translate_wildcards(text: str) -> str:
+  return re.escape(text).replace(r'\*', '.*').replace(r'\?', '.')
+
+
+def _is_literal(segment: str) -> bool:
+  return not _PLACEHOLDER.search(segment) and not _WILDCARD.search(segment)
+
+
+def _scan(directory: str, segments: list[str], captures: dict[str, str],
+          matches: list[tuple[str, dict[str, str]]]):
+  segment, rest = segments[0], segments[1:]
+  if _is_literal(segment):
+    path = os.path.join(directory, segment)
+    if rest:
+      _scan(path, rest, captures, matches)
+    elif os.path.isfile(path):
+      matches.append((path, captures))
+    return
+
+  regex = _translate(segment)
+  try:
+    entries = os.scandir(directory)
+  except (FileNotFoundError, NotADirectoryError):
+    return
+  with entries:
+    for entry in entries:
+      # Like glob, wildcards do not match hidden files.
+      if entry.name.startswith('.') and not segment.startswith('.'):
+        continue
+      match = regex.fullmatch(entry.name)
+      if match is None:
+        continue
+      entry_captures = {**captures, **match.groupdict()}
+      if rest:
+        if entry.is_dir():
+          _scan(entry.path, rest, entry_captures, matches)
+      elif entry.is_file():
+        matches.append((entry.path, entry_captures))
+
+
+def _load_file(path: str, hash_file: bool,
+               hash_algorithm: str) -> resources.File:
+  file = resources.File(path)
+  if hash_file:
+    file.hash(hash_algorithm)
+  return file
+
+
+def grid_from_glob(
+    pattern: str,
+    hash_files: bool = True,
+    max_workers: Union[int, None] = None,
+    sort_key: Union[Callable[[str], Any], None] = None,
+    root_dir: Union[str, None] = None,
+    hash_algorithm: str = resources.HASH_ALGORITHM) -> pd.DataFrame:
+  """Builds a table of files from a path pattern.
+
+  `pattern` is a path in which `{row}` and `{column}` stand for the parts that
+  name the row and the column of each file, e.g.
+  `'assets/{column}/{row}.jpg'`. It may also contain the wildcards `*` and `?`,
+  which, like the placeholders, do not match across directories. Only the
+  directories that the pattern can match are listed, once each.
+
+  The matching files are then wrapped in `File` objects by `max_workers`
+  threads, which also compute their `hash_algorithm` hashes unless
+  `hash_files` is False, so that a following `upload_and_render_table` with
+  the same algorithm does not have to.
+
+  Rows and columns are sorted by `sort_key`, and cells without a file are
+  None. Relative patterns are resolved against `root_dir` (the current
+  directory by default).
+  """
+  import pandas as pd  # pylint: disable=import-outside-toplevel
+
+  resources.check_hash_algorithm(hash_algorithm)
+  pattern = os.path.expanduser(pattern)
+  names = _PLACEHOLDER.findall(pattern)
+  if sorted(names) != ['column', 'row']:
+    raise ValueError('The pattern must contain {row} and {column} exactly '
+                     f'once each: {pattern}')
+
+  root = pattern if os.path.isabs(pattern) else os.path.join(
+      root_dir or os.getcwd(), pattern)
+  segments = root.split(os.sep)
+  prefix = [segments.pop(0) or os.sep]
+  while len(segments) > 1 and _is_literal(segments[0]):
+    prefix.append(segments.pop(0))
+  matches: list[tuple[str, dict[str, str]]] = []
+  _scan(os.path.join(*prefix), segments, {}, matches)
+
+  cells = {}
+  for path, captures in matches:
+    key = (captures['row'], captures['column'])
+    if key in cells:
+      raise ValueError(f'Both {cells[key]} and {path} match row '
+                       f'{key[0]!r} and column {key[1]!r}')
+    cells[key] = path
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+    futures = {
+        key: executor.submit(_load_file, path, hash_files, hash_algorithm)
+        for key, path in cells.items()
+    }
+    files = {key: future.result() for key, future in futures.items()}
+
+  rows = sorted({row for row, _ in files}, key=sort_key)
+  columns = sorted({column for _, column in files}, key=sort_key)
+  return pd.DataFrame(
+      [[files.get((row, column)) for column in columns] for row in rows],
+      index=rows,
+      columns=columns)
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Union
+
+from esap import storage
+
+DEFAULT_PATH = '~/.esap/hash_index'
+
+# Entries for files modified more recently than this are not recorded, since a
+# later write within the same mtime tick would go unnoticed.
+_RACY_WINDOW_NS = 2 * 10**9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS hashes (
+  path TEXT NOT NULL,
+  algorithm TEXT NOT NULL,
+  size INTEGER NOT NULL,
+  mtime_ns INTEGER NOT NULL,
+  inode INTEGER NOT NULL,
+  digest TEXT NOT NULL,
+  PRIMARY KEY (path, algorithm)
+)
+"""
+
+
+class HashIndex(object):
+  """A persistent index of file digests keyed by file metadata.
+
+  An entry is valid as long as the absolute path, size, modification time and
+  inode of the file are unchanged, so known files are never read again.
+  """
+
+  def __init__(self, path: str = DEFAULT_PATH):
+    self.path = os.path.abspath(os.path.expanduser(path))
+    self._lock = threading.Lock()
+    self._conn = storage.connect_sqlite(self.path)
+    self._conn.execute(_SCHEMA)
+
+  def get(self, path: str, stat: os.stat_result,
+          algorithm: str) -> Union[str, None]:
+    try:
+      with self._lock:
+        row = self._conn.execute(
+            'SELECT size, mtime_ns, inode, digest FROM hashes '
+            'WHERE path = ? AND algorithm = ?', (path, algorithm)).fetchone()
+    except sqlite3.Error:
+      # The index is only an optimization; treat failures as misses.
+      return None
+    if row is None:
+      return None
+    size, mtime_ns, inode, digest = row
+    if (size, mtime_ns, inode) != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+      return None
+    return digest
+
+  def set(self, path: str, stat: os.stat_result, algorithm: str, digest: str):
+    if stat.st_mtime_ns > time.time_ns() - _RACY_WINDOW_NS:
+      return
+    try:
+      with self._lock:
+        self._conn.execute(
+            'INSERT OR REPLACE INTO hashes '
+            '(path, algorithm, size, mtime_ns, inode, digest) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (path, algorithm, stat.st_size, stat.st_mtime_ns, stat.st_ino,
+             digest))
+    except sqlite3.Error:
+      pass
+
+  def close(self):
+    with self._lock:
+      self._conn.close()
+
+
+_default_index: Union[HashIndex, None] = None
+_default_index_disabled = False
+_default_index_lock = threading.Lock()
+
+
+def get_default_index() -> Union[HashIndex, None]:
+  """Returns the index used by `File.hash()`, opening it on first use."""
+  global _default_index, _default_index_disabled
+  if _default_index is None and not _default_index_disabled:
+    with _default_index_lock:
+      if _default_index is None and not _default_index_disabled:
+        try:
+          _default_index = HashIndex()
+        except (OSError, sqlite3.Error):
+          # Hash without an index if the database cannot be opened.
+          _default_index_disabled = True
+  return _default_index
+
+
+def set_default_index(index: Union[HashIndex, None]):
+  """Replaces the index used by `File.hash()`. `None` disables indexing."""
+  global _default_index, _default_index_disabled
+  with _default_index_lock:
+    _default_index = index
+    _default_index_disabled = index is None
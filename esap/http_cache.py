@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import dataclasses
+import fnmatch
+import json
+import time
+from typing import Union
+
+from esap import storage
+
+RESPONSE_CACHE_PATH = '~/.esap/responses.db'
+DEFAULT_MAX_ENTRIES = 1024
+
+
+@dataclasses.dataclass
+class CachedResponse:
+  # The decoded body of the response.
+  content: str
+  # When the response was received or last revalidated.
+  stored_at: float
+  etag: Union[str, None] = None
+  last_modified: Union[str, None] = None
+
+  def conditional_headers(self) -> dict[str, str]:
+    headers = {}
+    if self.etag is not None:
+      headers['If-None-Match'] = self.etag
+    if self.last_modified is not None:
+      headers['If-Modified-Since'] = self.last_modified
+    return headers
+
+
+def _is_storable(response) -> bool:
+  cache_control = response.get('cache-control', '').lower()
+  return 'no-store' not in cache_control and ('etag' in response or
+                                              'last-modified' in response)
+
+
+class ResponseCache(object):
+  """Keeps the bodies of GET responses and revalidates them with esa.
+
+  Responses with an ETag or a Last-Modified header are stored in
+  `cache_storage`, by default a SQLite file at `RESPONSE_CACHE_PATH` that keeps
+  the `max_entries` most recently used responses. A stored response younger
+  than its TTL is returned without a request. An older one is requested with
+  `If-None-Match` and `If-Modified-Since`, and served from the cache if esa
+  answers 304 Not Modified.
+
+  The TTL of an endpoint is the value of the first pattern in `ttls` that
+  matches it, e.g. `{'v1/teams/*/members': 600}`, or `default_ttl` seconds.
+  Responses are stored by URI, so share a cache only between clients of the
+  same user.
+  """
+
+  def __init__(self,
+               cache_storage: Union[storage.BaseStorage, None] = None,
+               max_entries: int = DEFAULT_MAX_ENTRIES,
+               default_ttl: float = 0.0,
+               ttls: Union[dict[str, float], None] = None):
+    if cache_storage is None:
+      cache_storage = storage.SqliteStorage(RESPONSE_CACHE_PATH,
+                                            max_entries=max_entries)
+    self.cache_storage = cache_storage
+    self.default_ttl = default_ttl
+    self.ttls = dict(ttls or {})
+
+  def ttl(self, endpoint: str) -> float:
+    for pattern, ttl in self.ttls.items():
+      if fnmatch.fnmatchcase(endpoint, pattern):
+        return ttl
+    return self.default_ttl
+
+  def lookup(self, uri: str) -> Union[CachedResponse, None]:
+    value = self.cache_storage.get(uri)
+    if value is None:
+      return None
+    return CachedResponse(**json.loads(value))
+
+  def is_fresh(self, endpoint: str, cached: CachedResponse) -> bool:
+    return time.time() - cached.stored_at < self.ttl(endpoint)
+
+  def store(self, uri: str, response, content: bytes):
+    """Stores a 200 response if it can be revalidated later."""
+    if response.status != 200 or not _is_storable(response):
+      return
+    self._set(
+        uri,
+        CachedResponse(content.decode('utf-8'),
+                       time.time(),
+                       etag=response.get('etag'),
+                       last_modified=response.get('last-modified')))
+
+  def revalidate(self, uri: str, cached: CachedResponse, response):
+    """Records that a 304 response confirmed `cached`."""
+    self._set(
+        uri,
+        dataclasses.replace(cached,
+                            stored_at=time.time(),
+                            etag=response.get('etag', cached.etag),
+                            last_modified=response.get('last-modified',
+                                                       cached.last_modified)))
+
+  def clear(self):
+    self.cache_storage.set_from_dict({})
+
+  def _set(self, uri: str, cached: CachedResponse):
+    self.cache_storage.set(uri, json.dumps(dataclasses.asdict(cached)))
@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import concurrent.futures
+import dataclasses
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Callable, Sequence, Union
+
+from esap import resources
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_DIR = '~/.esap/optimized_images'
+
+# Formats that can be recompressed without losing animation or vector data.
+_FORMATS_BY_MIMETYPE = {
+    'image/bmp': 'BMP',
+    'image/jpeg': 'JPEG',
+    'image/png': 'PNG',
+    'image/tiff': 'TIFF',
+    'image/webp': 'WEBP',
+}
+
+_EXTENSIONS = {
+    'BMP': '.bmp',
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'TIFF': '.tiff',
+    'WEBP': '.webp',
+}
+
+# Image info that affects how pixels look and is kept when stripping metadata.
+_KEPT_INFO = ('icc_profile', 'transparency')
+
+
+@dataclasses.dataclass(frozen=True)
+class ImageOptions:
+  """Settings of the optimization applied to images before they are uploaded.
+
+  Images larger than `max_dimension` pixels on either side are scaled down to
+  fit. `format` (e.g. `'JPEG'` or `'WEBP'`) converts the images; by default
+  they keep their format. `quality` applies to lossy formats. With
+  `strip_metadata`, EXIF, XMP and text chunks are dropped after applying the
+  EXIF orientation.
+  """
+  max_dimension: Union[int, None] = None
+  format: Union[str, None] = None
+  quality: int = 85
+  strip_metadata: bool = True
+
+  def digest(self) -> str:
+    settings = json.dumps(dataclasses.asdict(self), sort_keys=True)
+    return hashlib.sha256(settings.encode('utf-8')).hexdigest()[:16]
+
+
+@dataclasses.dataclass
+class OptimizedImage:
+  """The outcome of optimizing `source`. `file` is the file to upload."""
+  source: resources.File
+  file: resources.File
+
+  @property
+  def original_size(self) -> int:
+    return self.source.size
+
+  @property
+  def optimized_size(self) -> int:
+    return self.file.size
+
+
+def _optimize_image(source_path: str, output_path: str, output_format: str,
+                    options: ImageOptions):
+  """Writes the optimized image. Runs in a worker process."""
+  from PIL import Image  # pylint: disable=import-outside-toplevel
+  from PIL import ImageOps  # pylint: disable=import-outside-toplevel
+
+  with Image.open(source_path) as image:
+    if options.strip_metadata:
+      image = ImageOps.exif_transpose(image)
+    if options.max_dimension is not None:
+      image.thumbnail((options.max_dimension, options.max_dimension),
+                      Image.Resampling.LANCZOS)
+    save_args = {}
+    if options.strip_metadata:
+      image.info = {
+          key: image.info[key] for key in _KEPT_INFO if key in image.info
+      }
+    elif 'exif' in image.info:
+      save_args['exif'] = image.info['exif']
+    if output_format in ('JPEG', 'WEBP'):
+      save_args['quality'] = options.quality
+      if output_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    if output_format in ('JPEG', 'PNG'):
+      save_args['optimize'] = True
+    # Encoders such as JPEG's only write these when passed to `save`.
+    for key in _KEPT_INFO:
+      if key in image.info:
+        save_args[key] = image.info[key]
+
+    # Write to a temporary file first so that the cache never holds a partial
+    # image.
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(output_path))
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        image.save(f, format=output_format, **save_args)
+      os.replace(temp_path, output_path)
+    except BaseException:
+      os.unlink(temp_path)
+      raise
+
+
+class ImageOptimizer(object):
+  """Shrinks images before upload in a pool of worker processes.
+
+  Each image is resized and recompressed according to `options`. The output is
+  cached in `cache_dir` under the hash of the source and the settings, so
+  unchanged images are only processed once. If the output is not smaller than
+  the source, or the file is not an image that can be recompressed, the source
+  is uploaded as is. Every result is logged and passed to `on_result`.
+
+  Requires Pillow, which is installed with `pip install esap[images]`.
+  """
+
+  def __init__(self,
+               options: Union[ImageOptions, None] = None,
+               cache_dir: str = DEFAULT_CACHE_DIR,
+               max_workers: Union[int, None] = None,
+               on_result: Union[Callable[[OptimizedImage], None], None] = None):
+    try:
+      import PIL  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError as e:
+      raise ImportError('Image optimization requires Pillow. Install it with '
+                        '`pip install esap[images]`.') from e
+    self.options = options or ImageOptions()
+    self.cache_dir = os.path.abspath(os.path.expanduser(cache_dir))
+    self.max_workers = max_workers
+    self.on_result = on_result
+    self._executor: Union[concurrent.futures.ProcessPoolExecutor, None] = None
+
+  def optimize(self, files: Sequence[resources.File]) -> list[OptimizedImage]:
+    """Optimizes `files` and returns the results in the same order."""
+    images = [file for file in files if file.mimetype in _FORMATS_BY_MIMETYPE]
+    # The sources are hashed for the cache keys; reading is I/O bound.
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+      list(executor.map(lambda file: file.hash(), images))
+
+    futures: dict[str, concurrent.futures.Future] = {}
+    outputs: dict[int, tuple[str, concurrent.futures.Future]] = {}
+    for file in images:
+      output_format = (self.options.format or
+                       _FORMATS_BY_MIMETYPE[file.mimetype]).upper()
+      extension = _EXTENSIONS.get(output_format, '.' + output_format.lower())
+      output_path = os.path.join(
+          self.cache_dir, f'{file.hash()}-{self.options.digest()}{extension}')
+      if output_path not in futures:
+        futures[output_path] = self._submit(file, output_path, output_format)
+      outputs[id(file)] = (output_path, futures[output_path])
+
+    results = []
+    for file in files:
+      if id(file) not in outputs:
+        results.append(OptimizedImage(file, file))
+        continue
+      output_path, future = outputs[id(file)]
+      result = OptimizedImage(file, file)
+      try:
+        future.result()
+      except Exception as e:  # pylint: disable=broad-except
+        # Optimization is best effort; upload the source instead.
+        _logger.warning('Failed to optimize %s: %r', file.path, e)
+      else:
+        optimized = resources.File(output_path)
+        if optimized.size < file.size:
+          # Keep the name of the source, with the extension of the output.
+          optimized.name = (os.path.splitext(file.name)[0] +
+                            os.path.splitext(output_path)[1])
+          result = OptimizedImage(file, optimized)
+      _logger.info('Image size of %s: %d -> %d bytes', file.path,
+                   result.original_size, result.optimized_size)
+      if self.on_result is not None:
+        self.on_result(result)
+      results.append(result)
+    return results
+
+  def close(self):
+    if self._executor is not None:
+      self._executor.shutdown()
+      self._executor = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _submit(self, file: resources.File, output_path: str,
+              output_format: str) -> concurrent.futures.Future:
+    if os.path.exists(output_path):
+      future = concurrent.futures.Future()
+      future.set_result(None)
+      return future
+    if self._executor is None:
+      os.makedirs(self.cache_dir, exist_ok=True)
+      self._executor = concurrent.futures.ProcessPoolExecutor(self.max_workers)
+    return self._executor.submit(_optimize_image, file.path, output_path,
+                                 output_format, self.options)
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import collections
+import contextlib
+import json
+import os
+import threading
+from typing import Callable, Iterator, Sequence, Union
+
+from esap import resources
+
+STATE_DONE = 'done'
+STATE_FAILED = 'failed'
+
+
+def _cached_digest(file: resources.File, algorithm: str) -> Union[str, None]:
+  if algorithm == resources.HASH_ALGORITHM:
+    return file.cached_hash
+  return file.cached_hashes.get(algorithm)
+
+
+class BatchJournal(object):
+  """An append-only record of the cells of an upload batch.
+
+  Each finished cell is appended to the file at `path` as a JSON line holding
+  its coordinates, the team, the file path, size, mtime, inode and digest with
+  its hash algorithm, the upload state and the URL. When a batch is run again
+  with the same journal, cells recorded as done are looked up by their
+  coordinates and skipped without hashing as long as their file is unchanged
+  and they were uploaded to the same team with the same hash algorithm, so an
+  interrupted batch resumes with the pending cells only.
+  """
+
+  def __init__(self, path: str):
+    self.path = os.path.abspath(os.path.expanduser(path))
+    self._lock = threading.Lock()
+    self._entries: dict[tuple[int, int], dict] = self._read()
+    self._file = None
+
+  def lookup(self,
+             row: int,
+             column: int,
+             file: resources.File,
+             team: str,
+             algorithm: str = resources.HASH_ALGORITHM) -> Union[str, None]:
+    """Returns the URL of a finished cell if it still holds the same file."""
+    entry = self._entries.get((row, column))
+    if entry is None or entry.get('state') != STATE_DONE:
+      return None
+    if entry.get('team') != team or entry.get('algorithm') != algorithm:
+      return None
+    # Entries without a stat, written by older versions, never match.
+    recorded = (entry.get('path'), entry.get('size'), entry.get('mtime_ns'),
+                entry.get('inode'))
+    if recorded != resources.build_stat_key(file):
+      return None
+    if not file.is_hashed(algorithm) and entry.get('digest'):
+      if algorithm == resources.HASH_ALGORITHM:
+        file.cached_hash = entry['digest']
+      else:
+        file.cached_hashes[algorithm] = entry['digest']
+    return entry.get('url')
+
+  def record(self,
+             row: int,
+             column: int,
+             file: resources.File,
+             state: str,
+             team: str,
+             algorithm: str = resources.HASH_ALGORITHM,
+             url: Union[str, None] = None,
+             error: Union[str, None] = None):
+    stat_key = resources.build_stat_key(file)
+    _, size, mtime_ns, inode = stat_key or (None, file.size, None, None)
+    entry = {
+        'row': row,
+        'column': column,
+        'team': team,
+        'path': file.path,
+        'size': size,
+        'mtime_ns': mtime_ns,
+        'inode': inode,
+        'algorithm': algorithm,
+        'digest': _cached_digest(file, algorithm),
+        'state': state,
+        'url': url,
+    }
+    if error is not None:
+      entry['error'] = error
+    line = json.dumps(entry, ensure_ascii=False) + '\n'
+    with self._lock:
+      if self._file is None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+      self._file.write(line)
+      # Flush every line so that a crash loses at most the cell in progress.
+      self._file.flush()
+      self._entries[(row, column)] = entry
+
+  def close(self):
+    with self._lock:
+      if self._file is not None:
+        self._file.close()
+        self._file = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _read(self) -> dict[tuple[int, int], dict]:
+    entries = {}
+    try:
+      with open(self.path, 'r', encoding='utf-8') as f:
+        for line in f:
+          try:
+            entry = json.loads(line)
+            entries[(entry['row'], entry['column'])] = entry
+          except (ValueError, KeyError, TypeError):
+            # A line cut short by a crash.
+            continue
+    except FileNotFoundError:
+      pass
+    return entries
+
+
+@contextlib.contextmanager
+def open_journal(
+    journal: Union[str, BatchJournal, None]) -> Iterator[BatchJournal]:
+  """Opens `journal` if it is a path, closing it again on exit."""
+  if isinstance(journal, str):
+    with BatchJournal(journal) as opened:
+      yield opened
+  else:
+    yield journal
+
+
+def resume(
+    journal: Union[BatchJournal, None],
+    cells: Sequence[tuple[int, int, resources.File]],
+    team: str,
+    algorithm: str = resources.HASH_ALGORITHM
+) -> tuple[list[Union[str, None]], list[int]]:
+  """Returns the journaled URLs of `cells` and the indices still pending."""
+  if journal is None:
+    return [None] * len(cells), list(range(len(cells)))
+  urls: list[Union[str, None]] = []
+  pending = []
+  for k, (i, j, file) in enumerate(cells):
+    url = journal.lookup(i, j, file, team, algorithm)
+    urls.append(url)
+    if url is None:
+      pending.append(k)
+  return urls, pending
+
+
+def make_recorder(
+    journal: BatchJournal,
+    cells: Sequence[tuple[int, int, resources.File]],
+    pending: Sequence[int],
+    team: str,
+    algorithm: str = resources.HASH_ALGORITHM
+) -> Callable[[resources.File, str], None]:
+  """Returns an `on_complete` callback that journals the pending cells."""
+  cells_by_file = collections.defaultdict(list)
+  for k in pending:
+    i, j, file = cells[k]
+    cells_by_file[id(file)].append((i, j))
+
+  def record(file: resources.File, url: str):
+    # A `File` object shared by several cells is uploaded once for all.
+    for i, j in cells_by_file.pop(id(file), ()):
+      journal.record(i, j, file, STATE_DONE, team, algorithm, url=url)
+
+  return record
+
+
+def record_failures(journal: BatchJournal,
+                    cells: Sequence[tuple[int, int, resources.File]],
+                    failures: Sequence[tuple[int, BaseException]],
+                    team: str,
+                    algorithm: str = resources.HASH_ALGORITHM):
+  for k, exception in failures:
+    i, j, file = cells[k]
+    journal.record(i,
+                   j,
+                   file,
+                   STATE_FAILED,
+                   team,
+                   algorithm,
+                   error=repr(exception))
@@ -1,18 +1,92 @@
 import abc
-
-from lxml import html
+import collections
+import re
+import threading
+import urllib.parse
 
 from esap import resources
 
+# Characters that cannot appear in an HTML attribute or text node.
+_INVALID_CHARS = re.compile(
+    r'[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]')
+
+# Characters kept as-is in URI attributes, besides letters, digits and `-_.~`.
+_URI_SAFE_CHARS = "!*'()@/:=?;#%&,+<>"
+
+# URIs made of these characters only need no escaping at all.
+_PLAIN_URI = re.compile(r"[A-Za-z0-9\-_.~!*'()@/:=?;#%,+]*")
+
+# Text made of these characters only needs no escaping at all.
+_PLAIN_TEXT = re.compile(r'[\t\n\r !#-%\'-;=?-~]*')
+
+# HTML 4 script entities, which lxml keeps as-is in attribute values.
+_SCRIPT_ENTITY = re.compile(r'(&\{[^}]*\})')
+
+
+def _check_chars(value: str):
+  if _INVALID_CHARS.search(value):
+    raise ValueError('All strings must be XML compatible: Unicode or ASCII, '
+                     'no NULL bytes or control characters')
+
+
+def _escape_entities(value: str) -> str:
+  return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def _escape_attribute_entities(value: str) -> str:
+  if '&{' not in value:
+    return _escape_entities(value)
+  parts = _SCRIPT_ENTITY.split(value)
+  parts[::2] = [_escape_entities(part) for part in parts[::2]]
+  return ''.join(parts)
+
+
+def _to_ascii(value: str) -> str:
+  return value.encode('ascii', 'xmlcharrefreplace').decode('ascii')
 
-def _html_element_to_string(element: html.HtmlElement) -> str:
-  temp = html.tostring(element)
-  if isinstance(temp, bytes):
-    temp = temp.decode('utf-8')
-  return temp
+
+def escape_text(value: str) -> str:
+  """Escapes `value` for use as the text of an HTML element."""
+  if _PLAIN_TEXT.fullmatch(value):
+    return value
+  _check_chars(value)
+  return _to_ascii(_escape_entities(value))
+
+
+def quote_attribute(value: str) -> str:
+  """Escapes and quotes `value` for use as an HTML attribute value."""
+  if _PLAIN_TEXT.fullmatch(value):
+    return f'"{value}"'
+  _check_chars(value)
+  value = _to_ascii(_escape_attribute_entities(value))
+  if '"' not in value:
+    return f'"{value}"'
+  if "'" not in value:
+    return f"'{value}'"
+  return '"' + value.replace('"', '&quot;') + '"'
+
+
+def quote_uri_attribute(value: str) -> str:
+  """Escapes and quotes `value` for use as an `href` or `src` attribute value.
+
+  Like lxml, leading whitespace is dropped and characters that are not allowed
+  in URIs are percent-encoded as UTF-8.
+  """
+  if _PLAIN_URI.fullmatch(value):
+    return f'"{value}"'
+  _check_chars(value)
+  value = _escape_attribute_entities(value.lstrip(' \t\n\r'))
+  return '"' + urllib.parse.quote(value, safe=_URI_SAFE_CHARS) + '"'
 
 
 class BaseRenderer(abc.ABC):
+  """Renders files of some mimetypes as HTML.
+
+  `can_handle` must depend on the mimetype only, since its result is memoized
+  per mimetype. Renderers whose output depends only on the name of the file
+  and the URL may set `reusable`, which lets `render` reuse their fragments.
+  """
+  reusable = False
 
   @abc.abstractmethod
   def can_handle(self, mimetype: str) -> bool:
@@ -24,53 +98,46 @@ class BaseRenderer(abc.ABC):
 
 
 class ImageRenderer(BaseRenderer):
+  reusable = True
 
   def can_handle(self, mimetype: str) -> bool:
     return mimetype.startswith('image/')
 
   def render(self, file: resources.File, url: str) -> str:
-    img = html.Element('img')
-    img.set('alt', file.name)
-    img.set('src', url)
-    return _html_element_to_string(img)
+    return (f'<img alt={quote_attribute(file.name)} '
+            f'src={quote_uri_attribute(url)}>')
 
 
 class AudioRenderer(BaseRenderer):
+  reusable = True
 
   def can_handle(self, mimetype: str) -> bool:
     return mimetype.startswith('audio/')
 
   def render(self, file: resources.File, url: str) -> str:
-    audio = html.Element('audio')
-    audio.set('controls')
-    audio.set('alt', file.name)
-    audio.set('src', url)
-    return _html_element_to_string(audio)
+    return (f'<audio controls alt={quote_attribute(file.name)} '
+            f'src={quote_uri_attribute(url)}></audio>')
 
 
 class VideoRenderer(BaseRenderer):
+  reusable = True
 
   def can_handle(self, mimetype: str) -> bool:
     return mimetype.startswith('video/')
 
   def render(self, file: resources.File, url: str) -> str:
-    video = html.Element('video')
-    video.set('controls')
-    video.set('alt', file.name)
-    video.set('src', url)
-    return _html_element_to_string(video)
+    return (f'<video controls alt={quote_attribute(file.name)} '
+            f'src={quote_uri_attribute(url)}></video>')
 
 
 class DefaultRenderer(BaseRenderer):
+  reusable = True
 
   def can_handle(self, mimetype: str) -> bool:
     return True
 
   def render(self, file: resources.File, url: str) -> str:
-    a = html.Element('a')
-    a.set('href', url)
-    a.text = file.name
-    return _html_element_to_string(a)
+    return f'<a href={quote_uri_attribute(url)}>{escape_text(file.name)}</a>'
 
 
 _RENDERING_HANDLERS = [
@@ -80,9 +147,53 @@ _RENDERING_HANDLERS = [
     DefaultRenderer(),
 ]
 
+# Maps mimetypes to the first renderer in `_RENDERING_HANDLERS` that can handle
+# them.
+_renderers_by_mimetype: dict = {}
+_renderers_lock = threading.Lock()
+
+# Fragments of reusable renderers by renderer, file name and URL, with the
+# least recently used first.
+FRAGMENT_CACHE_SIZE = 65536
+_fragments: collections.OrderedDict = collections.OrderedDict()
+_fragments_lock = threading.Lock()
+
+
+def register_renderer(renderer: BaseRenderer):
+  """Makes `renderer` take precedence over the renderers registered so far."""
+  with _renderers_lock:
+    _RENDERING_HANDLERS.insert(0, renderer)
+    _renderers_by_mimetype.clear()
+
+
+def get_renderer(mimetype: str) -> BaseRenderer:
+  renderer = _renderers_by_mimetype.get(mimetype)
+  if renderer is None:
+    with _renderers_lock:
+      for candidate in _RENDERING_HANDLERS:
+        if candidate.can_handle(mimetype):
+          renderer = candidate
+          break
+      else:
+        raise RuntimeError(f'No renderer found for mimetype: {mimetype}')
+      _renderers_by_mimetype[mimetype] = renderer
+  return renderer
+
 
 def render(file: resources.File, url: str) -> str:
-  for renderer in _RENDERING_HANDLERS:
-    if renderer.can_handle(file.mimetype):
-      return renderer.render(file, url)
-  raise RuntimeError(f'No renderer found for file: {file}')
+  renderer = get_renderer(file.mimetype)
+  if not renderer.reusable:
+    return renderer.render(file, url)
+
+  key = (renderer, file.name, url)
+  with _fragments_lock:
+    fragment = _fragments.get(key)
+    if fragment is not None:
+      _fragments.move_to_end(key)
+      return fragment
+  fragment = renderer.render(file, url)
+  with _fragments_lock:
+    _fragments[key] = fragment
+    if len(_fragments) > FRAGMENT_CACHE_SIZE:
+      _fragments.popitem(last=False)
+  return fragment
@@ -1,17 +1,224 @@
+from __future__ import annotations
+
+import collections
+import io
+import math
 import re
+from typing import (Callable, Iterable, Iterator, Mapping, TextIO,
+                    TYPE_CHECKING, Union)
+
+if TYPE_CHECKING:
+  import pandas as pd
 
 _MAX_DIVIDER_LENGTH = 8
 
+# Column types ordered from the least to the most generic, as in tabulate.
+_NONE, _BOOL, _INT, _FLOAT, _BYTES, _STR = range(6)
+_NUMERIC_TYPES = (_INT, _FLOAT)
 
-def minify_markdown_table(md: str) -> str:
+# Cells with these characters are passed through `minify_markdown_table` line
+# by line, since it changes spaces around pipes and splits lines.
+_NEEDS_MINIFY = re.compile('[|\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+def _strip_cell_padding(md: str) -> list[str]:
   # Remove extra spaces around cells
   md = re.sub(r'\| *', '| ', md)
   md = re.sub(r' *\|', ' |', md)
   lines = md.splitlines()
-  lines = [line.strip() for line in lines]
+  return [line.strip() for line in lines]
+
+
+def minify_markdown_table(md: str) -> str:
+  lines = _strip_cell_padding(md)
   if len(lines) > 1:
     # Limit the length of divider
     pattern = fr'-{{{_MAX_DIVIDER_LENGTH},}}'
     lines[1] = re.sub(pattern, '-' * _MAX_DIVIDER_LENGTH, lines[1])
   md = '\n'.join(lines)
   return md
+
+
+def _is_convertible(conv: Callable, value) -> bool:
+  try:
+    conv(value)
+    return True
+  except (ValueError, TypeError):
+    return False
+
+
+def _is_number(value) -> bool:
+  if not _is_convertible(float, value):
+    return False
+  if isinstance(value, (str, bytes)) and (math.isinf(float(value)) or
+                                          math.isnan(float(value))):
+    return value.lower() in ['inf', '-inf', 'nan']
+  return True
+
+
+def _cell_type(value) -> int:
+  if value is None:
+    return _NONE
+  if hasattr(value, 'isoformat'):
+    return _STR
+  is_text = isinstance(value, (str, bytes))
+  if type(value) is bool or (is_text and value in ('True', 'False')):  # pylint: disable=unidiomatic-typecheck
+    return _BOOL
+  if type(value) is int or (is_text and _is_convertible(int, value)):  # pylint: disable=unidiomatic-typecheck
+    return _INT
+  if _is_number(value):
+    return _FLOAT
+  if isinstance(value, bytes):
+    return _BYTES
+  return _STR
+
+
+def _format_cell(value, column_type: int) -> str:
+  if value is None:
+    return ''
+  if column_type == _INT:
+    return format(value, '')
+  if column_type == _FLOAT:
+    return format(float(value), 'g')
+  if column_type == _BYTES:
+    try:
+      return str(value, 'ascii')
+    except (TypeError, UnicodeDecodeError):
+      return str(value)
+  return f'{value}'
+
+
+def _digits_after_point(text: str) -> int:
+  if not _is_number(text) or _is_convertible(int, text):
+    return -1
+  pos = text.rfind('.')
+  if pos < 0:
+    pos = text.lower().rfind('e')
+  return len(text) - pos - 1 if pos >= 0 else -1
+
+
+def _is_multiline(text: str) -> bool:
+  return '\n' in text or '\r' in text
+
+
+def _width_function() -> Callable[[str], int]:
+  try:
+    import wcwidth  # pylint: disable=import-outside-toplevel
+  except ImportError:
+    return len
+  return wcwidth.wcswidth
+
+
+def _format_line(cells: list[str]) -> str:
+  line = '|' + '|'.join(f' {cell} ' if cell else ' ' for cell in cells) + '|'
+  if any(_NEEDS_MINIFY.search(cell) for cell in cells):
+    line = '\n'.join(_strip_cell_padding(line))
+  return line
+
+
+def _scan_column_types(headers: list[str],
+                       rows: Iterable[list]) -> tuple[list[int], bool]:
+  """Returns the type of every column and whether any cell spans lines."""
+  column_types = [_BOOL] * len(headers)
+  is_multiline = any(_is_multiline(header) for header in headers)
+  for row in rows:
+    for j, value in enumerate(row):
+      if column_types[j] != _STR:
+        column_types[j] = max(column_types[j], _cell_type(value))
+      if isinstance(value, str) and _is_multiline(value):
+        is_multiline = True
+  return column_types, is_multiline
+
+
+def _build_divider(headers: list[str], rows: Iterable[list],
+                   column_types: list[int]) -> list[str]:
+  # Only the width of narrow columns is visible, in the length of the divider.
+  width_of = _width_function()
+  widths = [width_of(header) + 2 for header in headers]
+  narrow = [
+      j for j, width in enumerate(widths) if width + 1 < _MAX_DIVIDER_LENGTH
+  ]
+  max_decimals = [-1] * len(headers)
+  max_integral_widths = [0] * len(headers)
+  for row in rows:
+    if not narrow:
+      break
+    for j in narrow:
+      text = _format_cell(row[j], column_types[j])
+      if column_types[j] in _NUMERIC_TYPES:
+        # Numbers are padded on the right to align their decimal points.
+        decimals = _digits_after_point(text)
+        max_decimals[j] = max(max_decimals[j], decimals)
+        max_integral_widths[j] = max(max_integral_widths[j],
+                                     width_of(text) - decimals)
+        width = max_integral_widths[j] + max_decimals[j]
+      else:
+        width = width_of(text.strip())
+      widths[j] = max(widths[j], width)
+    narrow = [j for j in narrow if widths[j] + 1 < _MAX_DIVIDER_LENGTH]
+
+  divider = []
+  for width, column_type in zip(widths, column_types):
+    dashes = '-' * min(width + 1, _MAX_DIVIDER_LENGTH)
+    divider.append(dashes + ':' if column_type in _NUMERIC_TYPES else ':' +
+                   dashes)
+  return divider
+
+
+def write_markdown_table(
+    df: pd.DataFrame,
+    file: Union[TextIO, None] = None,
+    overrides: Union[Mapping[tuple[int, int], str], None] = None
+) -> Union[str, None]:
+  """Writes `df` as a minified markdown table, one row at a time.
+
+  The output is the same as `minify_markdown_table(df.to_markdown())`, without
+  building the padded table in between. `overrides` maps `(row, column)`
+  positions to values that replace the ones in `df`. Returns the table if no
+  `file` is given.
+  """
+  if file is None:
+    with io.StringIO() as buffer:
+      write_markdown_table(df, buffer, overrides)
+      return buffer.getvalue()
+
+  values = df.values
+  index = list(df.index)
+  overrides_by_row = collections.defaultdict(dict)
+  for (i, j), value in (overrides or {}).items():
+    # Shift by one for the index column.
+    overrides_by_row[i][j + 1] = value
+
+  def iter_rows() -> Iterator[list]:
+    for i, row in enumerate(values):
+      row = [index[i], *row]
+      for j, value in overrides_by_row.get(i, {}).items():
+        row[j] = value
+      yield row
+
+  headers = ['' if df.index.name is None else str(df.index.name)]
+  headers.extend(str(column) for column in df.columns)
+
+  column_types, is_multiline = _scan_column_types(headers, iter_rows())
+  if is_multiline or not index:
+    # tabulate spreads cells with line breaks over several lines and drops the
+    # index of empty tables; leave these rare cases to it.
+    if overrides:
+      df = df.copy()
+      for (i, j), value in overrides.items():
+        df.iat[i, j] = value
+    file.write(minify_markdown_table(df.to_markdown()))
+    return None
+
+  file.write(_format_line([header.strip(' ') for header in headers]))
+  file.write('\n')
+  file.write(_format_line(_build_divider(headers, iter_rows(), column_types)))
+  for row in iter_rows():
+    cells = []
+    for value, column_type in zip(row, column_types):
+      text = _format_cell(value, column_type)
+      cells.append(
+          text.strip(' ') if column_type in _NUMERIC_TYPES else text.strip())
+    file.write('\n')
+    file.write(_format_line(cells))
+  return None
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import bisect
+import collections
+import dataclasses
+import json
+import os
+import threading
+import time
+from typing import Callable, TextIO, Union
+
+from esap import errors
+
+PHASE_HASH = 'hash'
+PHASE_CACHE_LOOKUP = 'cache_lookup'
+PHASE_CACHE_STORE = 'cache_store'
+PHASE_POLICIES = 'policies'
+PHASE_S3 = 's3'
+PHASE_RENDER = 'render'
+PHASE_REQUEST = 'request'
+
+# Upper bounds of the duration histogram buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+
+@dataclasses.dataclass
+class Span:
+  """A timed phase of an upload, or a single request to the esa API."""
+  # One of the `PHASE_*` constants.
+  phase: str
+  # Wall-clock time at which the span started.
+  timestamp: float
+  duration: float = 0.0
+  # The file path for upload phases, the endpoint for requests.
+  target: Union[str, None] = None
+  num_bytes: Union[int, None] = None
+  cache_hit: Union[bool, None] = None
+  status: Union[int, None] = None
+  error: Union[str, None] = None
+
+
+class _SpanContext(object):
+  __slots__ = ('_instrumentation', '_span', '_start')
+
+  def __init__(self, instrumentation: Instrumentation, span: Span):
+    self._instrumentation = instrumentation
+    self._span = span
+    self._start = 0.0
+
+  def __enter__(self) -> Span:
+    self._start = time.perf_counter()
+    return self._span
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    span = self._span
+    span.duration = time.perf_counter() - self._start
+    if exc_value is not None:
+      span.error = exc_type.__name__
+      if span.status is None and isinstance(exc_value, errors.HttpError):
+        span.status = exc_value.status_code
+    self._instrumentation.emit(span)
+
+
+class _NullSpan(object):
+  """Stands in for both the context and the span while nothing listens."""
+  __slots__ = ()
+
+  def __enter__(self) -> _NullSpan:
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    pass
+
+  def __setattr__(self, name: str, value):
+    pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Instrumentation(object):
+  """Times the phases of uploads and passes them as `Span`s to hooks.
+
+  Hooks are called on the thread that finished the span, so they must be
+  thread-safe and quick. While no hook is registered, `span` returns a shared
+  no-op context and nothing is timed.
+  """
+
+  def __init__(self):
+    # Replaced rather than mutated, so that `emit` needs no lock.
+    self._hooks: tuple[Callable[[Span], None], ...] = ()
+    self._lock = threading.Lock()
+
+  @property
+  def enabled(self) -> bool:
+    return bool(self._hooks)
+
+  def add_hook(self, hook: Callable[[Span], None]):
+    with self._lock:
+      self._hooks = self._hooks + (hook,)
+
+  def remove_hook(self, hook: Callable[[Span], None]):
+    with self._lock:
+      hooks = list(self._hooks)
+      hooks.remove(hook)
+      self._hooks = tuple(hooks)
+
+  def span(self, phase: str, **attributes):
+    """Returns a context manager that times `phase` and yields its `Span`.
+
+    Attributes such as `status` may be set on the span before it ends.
+    """
+    if not self._hooks:
+      return _NULL_SPAN
+    return _SpanContext(self, Span(phase, time.time(), **attributes))
+
+  def emit(self, span: Span):
+    for hook in self._hooks:
+      hook(span)
+
+
+@dataclasses.dataclass
+class PhaseStats:
+  count: int = 0
+  errors: int = 0
+  seconds: float = 0.0
+  max_seconds: float = 0.0
+  num_bytes: int = 0
+  cache_hits: int = 0
+  cache_misses: int = 0
+  statuses: collections.Counter[int] = dataclasses.field(
+      default_factory=collections.Counter)
+  # Spans per duration bucket; the last one counts the longer spans.
+  bucket_counts: list[int] = dataclasses.field(default_factory=list)
+
+  @property
+  def mean_seconds(self) -> float:
+    return self.seconds / self.count if self.count else 0.0
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+  pairs = ','.join(
+      f'{key}="{_escape_label(value)}"' for key, value in labels.items())
+  return '{' + pairs + '}'
+
+
+def _escape_label(value: str) -> str:
+  return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_number(value: float) -> str:
+  return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _append_counter(lines: list[str], name: str, description: str,
+                    samples: list[tuple[dict[str, str], int]]):
+  lines.append(f'# HELP {name} {description}')
+  lines.append(f'# TYPE {name} counter')
+  for labels, value in samples:
+    lines.append(f'{name}{_format_labels(labels)} {value}')
+
+
+class MetricsAggregator(object):
+  """A hook that sums up spans per phase in memory.
+
+  Register it with `Instrumentation.add_hook`; `snapshot` returns the totals
+  and `to_prometheus` renders them in the Prometheus text format.
+  """
+
+  def __init__(self, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+    self.buckets = tuple(sorted(buckets))
+    self._lock = threading.Lock()
+    self._stats: dict[str, PhaseStats] = {}
+
+  def __call__(self, span: Span):
+    bucket = bisect.bisect_left(self.buckets, span.duration)
+    with self._lock:
+      stats = self._stats.get(span.phase)
+      if stats is None:
+        stats = PhaseStats(bucket_counts=[0] * (len(self.buckets) + 1))
+        self._stats[span.phase] = stats
+      stats.count += 1
+      stats.seconds += span.duration
+      stats.max_seconds = max(stats.max_seconds, span.duration)
+      stats.bucket_counts[bucket] += 1
+      if span.error is not None:
+        stats.errors += 1
+      if span.num_bytes is not None:
+        stats.num_bytes += span.num_bytes
+      if span.cache_hit is not None:
+        if span.cache_hit:
+          stats.cache_hits += 1
+        else:
+          stats.cache_misses += 1
+      if span.status is not None:
+        stats.statuses[span.status] += 1
+
+  def snapshot(self) -> dict[str, PhaseStats]:
+    with self._lock:
+      return {
+          phase:
+          dataclasses.replace(stats,
+                              statuses=collections.Counter(stats.statuses),
+                              bucket_counts=list(stats.bucket_counts))
+          for phase, stats in self._stats.items()
+      }
+
+  def reset(self):
+    with self._lock:
+      self._stats.clear()
+
+  def to_prometheus(self, prefix: str = 'esap') -> str:
+    snapshot = self.snapshot()
+    lines = [
+        f'# HELP {prefix}_span_duration_seconds Time spent per phase.',
+        f'# TYPE {prefix}_span_duration_seconds histogram',
+    ]
+    for phase, stats in sorted(snapshot.items()):
+      cumulative = 0
+      bounds = [_format_number(bound) for bound in self.buckets] + ['+Inf']
+      for bound, count in zip(bounds, stats.bucket_counts):
+        cumulative += count
+        labels = _format_labels({'phase': phase, 'le': bound})
+        lines.append(f'{prefix}_span_duration_seconds_bucket{labels} '
+                     f'{cumulative}')
+      labels = _format_labels({'phase': phase})
+      lines.append(f'{prefix}_span_duration_seconds_sum{labels} '
+                   f'{_format_number(stats.seconds)}')
+      lines.append(f'{prefix}_span_duration_seconds_count{labels} '
+                   f'{stats.count}')
+
+    error_samples = []
+    byte_samples = []
+    cache_samples = []
+    status_samples = []
+    for phase, stats in sorted(snapshot.items()):
+      labels = {'phase': phase}
+      error_samples.append((labels, stats.errors))
+      if stats.num_bytes:
+        byte_samples.append((labels, stats.num_bytes))
+      if stats.cache_hits or stats.cache_misses:
+        cache_samples.append(({**labels, 'result': 'hit'}, stats.cache_hits))
+        cache_samples.append(({**labels, 'result': 'miss'}, stats.cache_misses))
+      for status, count in sorted(stats.statuses.items()):
+        status_samples.append(({**labels, 'status': str(status)}, count))
+    _append_counter(lines, f'{prefix}_span_errors_total',
+                    'Spans that ended with an exception.', error_samples)
+    _append_counter(lines, f'{prefix}_bytes_total',
+                    'Bytes hashed or transferred.', byte_samples)
+    _append_counter(lines, f'{prefix}_cache_lookups_total',
+                    'Attachment cache lookups by result.', cache_samples)
+    _append_counter(lines, f'{prefix}_http_responses_total',
+                    'HTTP responses by status.', status_samples)
+    return '\n'.join(lines) + '\n'
+
+
+class JsonLinesExporter(object):
+  """A hook that writes every span as a JSON line to `file`.
+
+  `file` is a path, which is opened for appending, or a text stream.
+  """
+
+  def __init__(self, file: Union[str, TextIO]):
+    self._owns_file = isinstance(file, str)
+    if self._owns_file:
+      path = os.path.abspath(os.path.expanduser(file))
+      os.makedirs(os.path.dirname(path), exist_ok=True)
+      file = open(path, 'a', encoding='utf-8')  # pylint: disable=consider-using-with
+    self._file = file
+    self._lock = threading.Lock()
+
+  def __call__(self, span: Span):
+    line = json.dumps(dataclasses.asdict(span), ensure_ascii=False) + '\n'
+    with self._lock:
+      self._file.write(line)
+      self._file.flush()
+
+  def close(self):
+    with self._lock:
+      if self._owns_file:
+        self._file.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+from typing import Iterator, Union
+
+from esap import errors
+from esap import resources
+
+BOUNDARY = '-------314159265358979323846'
+CRLF = b'\r\n'
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+
+class MultipartEncoder(object):
+  """A multipart/form-data body that streams its file fields from disk.
+
+  Iterating over the encoder yields the body in chunks of `chunk_size` bytes,
+  so memory usage is bounded by the chunk size rather than the file size.
+  Every iteration starts over from the beginning, which lets HTTP clients
+  resend the body on retries. The total length is known up front from the
+  file sizes and is available through `len()`.
+  """
+
+  def __init__(self,
+               fields: dict[str, Union[str, resources.File]],
+               boundary: str = BOUNDARY,
+               chunk_size: int = DEFAULT_CHUNK_SIZE):
+    self.boundary = boundary
+    self.chunk_size = chunk_size
+    self.content_type = f'multipart/form-data; boundary={boundary}'
+    self._parts: list[Union[bytes, resources.File]] = []
+    for key, value in fields.items():
+      lines = [f'--{boundary}']
+      if isinstance(value, resources.File):
+        lines.append(f'Content-Disposition: form-data; name="{key}"; '
+                     f'filename="{value.name}"')
+        lines.append(f'Content-Type: {value.mimetype}')
+        lines.append('')
+        self._parts.append(
+            CRLF.join(line.encode('utf-8') for line in lines) + CRLF)
+        self._parts.append(value)
+        self._parts.append(CRLF)
+      else:
+        lines.append(f'Content-Disposition: form-data; name="{key}"')
+        lines.append('')
+        lines.append(value)
+        lines.append('')
+        self._parts.append(CRLF.join(line.encode('utf-8') for line in lines))
+    self._parts.append(f'--{boundary}--'.encode('utf-8') + CRLF)
+    self.content_length = sum(
+        part.size if isinstance(part, resources.File) else len(part)
+        for part in self._parts)
+
+  def __len__(self) -> int:
+    return self.content_length
+
+  def __iter__(self) -> Iterator[bytes]:
+    # Small parts are coalesced with their neighbors so that the body goes out
+    # in as few writes as possible.
+    buffer = bytearray()
+    for part in self._parts:
+      if isinstance(part, resources.File):
+        for chunk in self._iter_file(part):
+          buffer += chunk
+          if len(buffer) >= self.chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+      else:
+        buffer += part
+        if len(buffer) >= self.chunk_size:
+          yield bytes(buffer)
+          buffer.clear()
+    if buffer:
+      yield bytes(buffer)
+
+  def _iter_file(self, file: resources.File) -> Iterator[bytes]:
+    remaining = file.size
+    with open(file.path, 'rb') as f:
+      while remaining > 0:
+        chunk = f.read(min(self.chunk_size, remaining))
+        if not chunk:
+          break
+        remaining -= len(chunk)
+        yield chunk
+    if remaining != 0:
+      raise errors.Error(f'File size changed while uploading: {file.path}')
@@ -1,3 +1,6 @@
+import threading
+from typing import Union
+
 import oauthlib.oauth2
 
 from esap import errors
@@ -14,6 +17,13 @@ def _load_client_secrets(client_secrets_storage: storage.BaseStorage):
   return client_id, client_secret
 
 
+def _parse_timestamp(value) -> Union[float, None]:
+  try:
+    return float(value)
+  except (TypeError, ValueError):
+    return None
+
+
 class OAuth2Client(oauthlib.oauth2.WebApplicationClient):
   """A client utilizing the authorization code grant workflow."""
 
@@ -23,8 +33,15 @@ class OAuth2Client(oauthlib.oauth2.WebApplicationClient):
     super().__init__(client_id, **kwargs)
     self.client_secret = client_secret
     self.credential_storage = credential_storage
+    # Held while the access token is refreshed, so that concurrent requests
+    # wait for one refresh instead of starting their own.
+    self.refresh_lock = threading.Lock()
     self._load_credentials()
 
+  @property
+  def expires_at(self) -> Union[float, None]:
+    return self._expires_at
+
   def set_code(self, code: str):
     self.code = code
 
@@ -32,6 +49,11 @@ class OAuth2Client(oauthlib.oauth2.WebApplicationClient):
     kwargs['client_secret'] = self.client_secret
     return super().prepare_token_request(*args, **kwargs)
 
+  def prepare_refresh_token_request(self, *args, **kwargs):
+    kwargs['client_id'] = self.client_id
+    kwargs['client_secret'] = self.client_secret
+    return super().prepare_refresh_token_request(*args, **kwargs)
+
   def parse_request_body_response(self, *args, **kwargs):
     super().parse_request_body_response(*args, **kwargs)
     self._save_credentials()
@@ -41,7 +63,8 @@ class OAuth2Client(oauthlib.oauth2.WebApplicationClient):
     self.access_token = credentials.get('access_token')
     self.refresh_token = credentials.get('refresh_token')
     self.token_type = credentials.get('token_type', 'Bearer')
-    self._expires_at = credentials.get('expires_at')
+    # Stored as text by file-backed storage.
+    self._expires_at = _parse_timestamp(credentials.get('expires_at'))
 
   def _save_credentials(self):
     credentials = {
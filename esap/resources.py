@@ -1,8 +1,16 @@
+from __future__ import annotations
+
+import concurrent.futures
 import dataclasses
 import hashlib
 import mimetypes
 import os
-from typing import Union
+from typing import Sequence, Union
+
+from esap import hash_index
+
+HASH_ALGORITHM = 'sha256'
+HASH_CHUNK_SIZE = 1024 * 1024
 
 
 def _guess_mimetype(path: str):
@@ -12,6 +20,40 @@ def _guess_mimetype(path: str):
   return mimetype
 
 
+def _hash_file(path: str,
+               algorithm: str = HASH_ALGORITHM,
+               chunk_size: int = HASH_CHUNK_SIZE) -> str:
+  digest = hashlib.new(algorithm)
+  buffer = bytearray(chunk_size)
+  view = memoryview(buffer)
+  with open(path, 'rb', buffering=0) as f:
+    while True:
+      size = f.readinto(buffer)
+      if not size:
+        break
+      digest.update(view[:size])
+  return digest.hexdigest()
+
+
+def build_stat_key(file: File) -> Union[tuple, None]:
+  """Identifies the current version of `file` by its path and stat."""
+  try:
+    stat = os.stat(file.path)
+  except OSError:
+    return None
+  return (file.path, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+
+def check_hash_algorithm(algorithm: str):
+  if algorithm not in hashlib.algorithms_available:
+    raise ValueError(f'Unsupported hash algorithm: {algorithm}')
+
+
+def _same_file_version(a: os.stat_result, b: os.stat_result) -> bool:
+  return (a.st_size, a.st_mtime_ns, a.st_ino) == (b.st_size, b.st_mtime_ns,
+                                                  b.st_ino)
+
+
 @dataclasses.dataclass
 class File:
   path: str
@@ -23,6 +65,10 @@ class File:
 
   # Cached hash value.
   cached_hash: Union[str, None] = None
+  # Cached hash values of algorithms other than `HASH_ALGORITHM`.
+  cached_hashes: dict[str, str] = dataclasses.field(default_factory=dict,
+                                                    repr=False,
+                                                    compare=False)
 
   def __post_init__(self):
     self.path = os.path.abspath(os.path.expanduser(self.path))
@@ -30,11 +76,53 @@ class File:
     self.name = os.path.basename(self.path)
     self.size = os.path.getsize(self.path)
 
-  def hash(self):
-    if self.cached_hash is None:
-      self.cached_hash = hashlib.sha256(self.read()).hexdigest()
-    return self.cached_hash
+  def hash(self, algorithm: str = HASH_ALGORITHM) -> str:
+    if algorithm == HASH_ALGORITHM:
+      if self.cached_hash is None:
+        self.cached_hash = self._compute_hash(algorithm)
+      return self.cached_hash
+    digest = self.cached_hashes.get(algorithm)
+    if digest is None:
+      digest = self._compute_hash(algorithm)
+      self.cached_hashes[algorithm] = digest
+    return digest
+
+  def is_hashed(self, algorithm: str = HASH_ALGORITHM) -> bool:
+    if algorithm == HASH_ALGORITHM:
+      return self.cached_hash is not None
+    return algorithm in self.cached_hashes
 
   def read(self):
     with open(self.path, 'rb') as f:
       return f.read()
+
+  def _compute_hash(self, algorithm: str) -> str:
+    index = hash_index.get_default_index()
+    if index is None:
+      return _hash_file(self.path, algorithm)
+
+    stat = os.stat(self.path)
+    digest = index.get(self.path, stat, algorithm)
+    if digest is None:
+      digest = _hash_file(self.path, algorithm)
+      # Only record the digest if the file did not change while reading it.
+      if _same_file_version(stat, os.stat(self.path)):
+        index.set(self.path, stat, algorithm, digest)
+    return digest
+
+
+def hash_files(files: Sequence[File],
+               algorithm: str = HASH_ALGORITHM,
+               max_workers: Union[int, None] = None) -> list[str]:
+  """Hashes `files` in a pool of `max_workers` threads.
+
+  hashlib releases the GIL while it digests each chunk, so large files are
+  hashed in parallel. The digests are cached on the files and returned in the
+  same order.
+  """
+  check_hash_algorithm(algorithm)
+  unhashed = {id(file): file for file in files if not file.is_hashed(algorithm)}
+  if len(unhashed) > 1:
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+      list(executor.map(lambda file: file.hash(algorithm), unhashed.values()))
+  return [file.hash(algorithm) for file in files]
@@ -0,0 +1,321 @@
+from __future__ import annotations
+
+import collections
+import dataclasses
+import email.utils
+import http.client
+import logging
+import random
+import socket
+import threading
+import time
+from typing import Awaitable, Callable, TypeVar, Union
+import urllib.parse
+
+_logger = logging.getLogger(__name__)
+
+_T = TypeVar('_T')
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# Methods whose requests can be sent again without changing the outcome.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+# Errors that are worth retrying, such as refused or dropped connections and
+# timeouts. Local errors such as a missing file are not.
+TRANSIENT_ERRORS = (ConnectionError, TimeoutError, socket.timeout,
+                    socket.gaierror, http.client.HTTPException)
+
+# Errors raised before a request reached the server, after which even a
+# request that is not idempotent can be sent again.
+CONNECT_ERRORS = (ConnectionRefusedError, socket.gaierror)
+
+
+@dataclasses.dataclass
+class ThrottleEvent:
+  """Records a request that was delayed and why."""
+  timestamp: float
+  host: str
+  # One of 'rate_limit' (the server-side budget is used up), 'pacing' (the
+  # token bucket is empty), 'retry_status' or 'retry_error'.
+  reason: str
+  delay: float
+  attempt: int = 0
+  status: Union[int, None] = None
+  error: Union[str, None] = None
+
+
+class TokenBucket(object):
+  """Hands out tokens at `rate` per second, allowing bursts of `capacity`."""
+
+  def __init__(self, rate: float, capacity: float):
+    self.rate = rate
+    self.capacity = capacity
+    self._tokens = capacity
+    self._updated_at = time.monotonic()
+
+  def configure(self, rate: float, capacity: float):
+    self._refill()
+    self.rate = rate
+    self.capacity = capacity
+    self._tokens = min(self._tokens, capacity)
+
+  def reserve(self) -> float:
+    """Takes a token and returns how long to wait before using it."""
+    self._refill()
+    self._tokens -= 1
+    if self._tokens >= 0:
+      return 0.0
+    return -self._tokens / self.rate
+
+  def _refill(self):
+    now = time.monotonic()
+    self._tokens = min(self.capacity,
+                       self._tokens + (now - self._updated_at) * self.rate)
+    self._updated_at = now
+
+
+@dataclasses.dataclass
+class _HostState:
+  limit: Union[int, None] = None
+  remaining: Union[int, None] = None
+  reset_at: Union[float, None] = None
+  # Set from the `rates` argument.
+  fixed_bucket: Union[TokenBucket, None] = None
+  # Derived from the rate limit headers; dropped when the limit resets.
+  adaptive_bucket: Union[TokenBucket, None] = None
+
+
+def _host_of(uri: str) -> str:
+  return urllib.parse.urlsplit(uri).netloc
+
+
+def _parse_int(value) -> Union[int, None]:
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    return None
+
+
+def _parse_retry_after(value) -> Union[float, None]:
+  if value is None:
+    return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  try:
+    retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+  except (TypeError, ValueError):
+    return None
+  return max(0.0, retry_at - time.time())
+
+
+class RequestScheduler(object):
+  """Paces requests per host and retries transient failures.
+
+  The scheduler follows esa's `X-RateLimit-*` response headers. Once a host
+  reports its budget, requests to it are paced by a token bucket that refills
+  at the remaining budget spread over the time left until the reset and holds
+  at most `burst` tokens (the whole remaining budget by default). When the
+  budget is used up, requests wait for the reset. Fixed rates in requests per
+  second can be set per host with `rates`. Responses with a status in
+  `RETRY_STATUSES` and errors in `TRANSIENT_ERRORS` are retried up to
+  `max_retries` times, honoring `Retry-After` and otherwise backing off
+  exponentially with full jitter. Requests that are not idempotent are only
+  retried when esa did not process them: on 429, on 503 with `Retry-After`,
+  or when the connection could not be made.
+
+  Every delay is recorded as a `ThrottleEvent` in `events`, passed to the
+  registered listeners and counted in `stats`.
+  """
+
+  def __init__(self,
+               max_retries: int = 5,
+               backoff_base: float = 0.5,
+               backoff_max: float = 30.0,
+               burst: Union[int, None] = None,
+               rates: Union[dict[str, float], None] = None,
+               max_events: int = 1000):
+    self.max_retries = max_retries
+    self.backoff_base = backoff_base
+    self.backoff_max = backoff_max
+    self.burst = burst
+    self.events: collections.deque[ThrottleEvent] = collections.deque(
+        maxlen=max_events)
+    self.stats: collections.Counter[str] = collections.Counter()
+    self._listeners: list[Callable[[ThrottleEvent], None]] = []
+    # Reentrant so that listeners may query the scheduler.
+    self._lock = threading.RLock()
+    self._hosts: dict[str, _HostState] = collections.defaultdict(_HostState)
+    for host, rate in (rates or {}).items():
+      self._hosts[host].fixed_bucket = TokenBucket(rate, burst or 1)
+
+  def add_listener(self, listener: Callable[[ThrottleEvent], None]):
+    self._listeners.append(listener)
+
+  def remove_listener(self, listener: Callable[[ThrottleEvent], None]):
+    self._listeners.remove(listener)
+
+  def rate_limit(self, host: str) -> tuple:
+    """Returns the last known `(limit, remaining, reset_at)` of `host`."""
+    with self._lock:
+      state = self._hosts[host]
+      return state.limit, state.remaining, state.reset_at
+
+  def call(self,
+           uri: str,
+           send: Callable[[], _T],
+           idempotent: bool = True) -> _T:
+    """Calls `send` for `uri`, waiting and retrying as needed.
+
+    `send` must return a `(response, content)` pair. Requests that are not
+    `idempotent` could take effect twice, so they are only retried on 429, on
+    503 with `Retry-After` and on errors in `CONNECT_ERRORS`.
+    """
+    for delay in self._acquire(uri):
+      time.sleep(delay)
+    attempt = 0
+    while True:
+      try:
+        result = send()
+      except TRANSIENT_ERRORS as e:
+        delay = self._on_error(uri, e, attempt, idempotent)
+        if delay is None:
+          raise
+      else:
+        delay = self._on_response(uri, result[0], attempt, idempotent)
+        if delay is None:
+          return result
+      time.sleep(delay)
+      attempt += 1
+      for delay in self._acquire(uri):
+        time.sleep(delay)
+
+  async def call_async(self,
+                       uri: str,
+                       send: Callable[[], Awaitable[_T]],
+                       idempotent: bool = True) -> _T:
+    """A coroutine version of `call`."""
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    for delay in self._acquire(uri):
+      await asyncio.sleep(delay)
+    attempt = 0
+    while True:
+      try:
+        result = await send()
+      except TRANSIENT_ERRORS + (asyncio.TimeoutError,) as e:
+        delay = self._on_error(uri, e, attempt, idempotent)
+        if delay is None:
+          raise
+      else:
+        delay = self._on_response(uri, result[0], attempt, idempotent)
+        if delay is None:
+          return result
+      await asyncio.sleep(delay)
+      attempt += 1
+      for delay in self._acquire(uri):
+        await asyncio.sleep(delay)
+
+  def _acquire(self, uri: str) -> list[float]:
+    """Returns the delays needed before a request to `uri` may be sent."""
+    host = _host_of(uri)
+    delays = []
+    with self._lock:
+      state = self._hosts[host]
+      now = time.time()
+      if state.reset_at is not None and state.reset_at <= now:
+        # The budget has been renewed; wait for fresh headers.
+        state.remaining = None
+        state.reset_at = None
+        state.adaptive_bucket = None
+      if state.remaining is not None:
+        if state.remaining <= 0:
+          delay = state.reset_at - now
+          self._record(host, 'rate_limit', delay)
+          delays.append(delay)
+          # The request goes out after the reset, when the budget is full.
+          state.adaptive_bucket = None
+        state.remaining -= 1
+      for bucket in (state.fixed_bucket, state.adaptive_bucket):
+        if bucket is not None:
+          delay = bucket.reserve()
+          if delay > 0:
+            self._record(host, 'pacing', delay)
+            delays.append(delay)
+    return delays
+
+  def _on_response(self, uri: str, response, attempt: int,
+                   idempotent: bool) -> Union[float, None]:
+    host = _host_of(uri)
+    status = response.status
+    with self._lock:
+      self.stats['requests'] += 1
+      self._update_rate_limit(host, response)
+      if status not in RETRY_STATUSES or attempt >= self.max_retries:
+        return None
+      delay = _parse_retry_after(response.get('retry-after'))
+      # Only these responses say that the request was not processed.
+      rejected = status == 429 or (status == 503 and delay is not None)
+      if not idempotent and not rejected:
+        return None
+      state = self._hosts[host]
+      if delay is None and status == 429 and state.reset_at is not None:
+        delay = max(0.0, state.reset_at - time.time())
+      if delay is None:
+        delay = self._backoff(attempt)
+      self._record(host, 'retry_status', delay, attempt=attempt, status=status)
+      return delay
+
+  def _on_error(self, uri: str, error: BaseException, attempt: int,
+                idempotent: bool) -> Union[float, None]:
+    host = _host_of(uri)
+    with self._lock:
+      self.stats['errors'] += 1
+      if attempt >= self.max_retries:
+        return None
+      if not idempotent and not isinstance(error, CONNECT_ERRORS):
+        return None
+      delay = self._backoff(attempt)
+      self._record(host,
+                   'retry_error',
+                   delay,
+                   attempt=attempt,
+                   error=repr(error))
+      return delay
+
+  def _update_rate_limit(self, host: str, response):
+    limit = _parse_int(response.get('x-ratelimit-limit'))
+    remaining = _parse_int(response.get('x-ratelimit-remaining'))
+    reset_at = _parse_int(response.get('x-ratelimit-reset'))
+    if remaining is None or reset_at is None:
+      return
+    state = self._hosts[host]
+    state.limit = limit
+    state.remaining = remaining
+    state.reset_at = float(reset_at)
+    # Spread the remaining budget evenly over the time left until the reset.
+    # An exhausted budget is handled by waiting for the reset instead.
+    window = max(1.0, state.reset_at - time.time())
+    rate = max(remaining, 1) / window
+    capacity = max(1, remaining)
+    if self.burst is not None:
+      capacity = min(capacity, self.burst)
+    if state.adaptive_bucket is None:
+      state.adaptive_bucket = TokenBucket(rate, capacity)
+    else:
+      state.adaptive_bucket.configure(rate, capacity)
+
+  def _backoff(self, attempt: int) -> float:
+    return random.uniform(0,
+                          min(self.backoff_max, self.backoff_base * 2**attempt))
+
+  def _record(self, host: str, reason: str, delay: float, **kwargs):
+    event = ThrottleEvent(time.time(), host, reason, delay, **kwargs)
+    self.events.append(event)
+    self.stats[reason] += 1
+    self.stats[f'{reason}_seconds'] += delay
+    _logger.info('Delaying request to %s by %.2fs (%s)', host, delay, reason)
+    for listener in self._listeners:
+      listener(event)
@@ -0,0 +1,293 @@
+from __future__ import annotations
+
+import asyncio
+from typing import (AsyncIterator, Awaitable, Callable, Sequence, TYPE_CHECKING,
+                    Union)
+
+from esap import errors
+from esap import journal as journal_lib
+from esap import metrics
+from esap import multipart
+from esap import resources
+from esap import storage
+from esap.base import BaseClient
+from esap.services import base
+from esap.services import team
+
+if TYPE_CHECKING:
+  import pandas as pd
+
+  from esap import images
+
+
+async def iter_pages(fetch_page: Callable[[int], Awaitable[dict]],
+                     key: str,
+                     prefetch: bool = True) -> AsyncIterator[dict]:
+  """An asyncio counterpart of `team.iter_pages`.
+
+  With `prefetch`, the next page is fetched by a task while the items of the
+  current one are consumed.
+  """
+  if not prefetch:
+    page = 1
+    while page is not None:
+      response = await fetch_page(page)
+      page = response.get('next_page')
+      for item in response[key]:
+        yield item
+    return
+
+  task = asyncio.ensure_future(fetch_page(1))
+  try:
+    while task is not None:
+      response = await task
+      next_page = response.get('next_page')
+      task = asyncio.ensure_future(fetch_page(next_page)) if next_page else None
+      for item in response.pop(key):
+        yield item
+  finally:
+    if task is not None:
+      task.cancel()
+
+
+class AsyncTeamService(base.Service):
+  """An asyncio counterpart of `TeamService`.
+
+  Requires a client whose request methods are coroutines, such as
+  `AsyncEsaClient`. It shares the attachment cache with `TeamService`.
+  """
+
+  def __init__(self,
+               client: BaseClient,
+               team_name: str,
+               cache_storage: Union[storage.BaseStorage, None] = None,
+               image_optimizer: Union[images.ImageOptimizer, None] = None,
+               hash_algorithm: str = resources.HASH_ALGORITHM):
+    super(AsyncTeamService, self).__init__(client)
+    self.team_name = team_name
+    self._cache_storage = cache_storage
+    self.image_optimizer = image_optimizer
+    resources.check_hash_algorithm(hash_algorithm)
+    self.hash_algorithm = hash_algorithm
+    self.instrumentation = client.instrumentation
+    if self.instrumentation is None:
+      self.instrumentation = metrics.Instrumentation()
+
+  @property
+  def cache_storage(self) -> storage.BaseStorage:
+    if self._cache_storage is None:
+      return team.get_cache_storage()
+    return self._cache_storage
+
+  async def upload_attachment(self,
+                              file: Union[str, resources.File],
+                              force_upload=False) -> str:
+    if isinstance(file, str):
+      file = resources.File(file)
+    file = (await self._optimize([file]))[0]
+    return await self._upload_attachment(file, force_upload, {})
+
+  async def upload_attachments(
+      self,
+      files: Sequence[Union[str, resources.File]],
+      force_upload=False,
+      on_complete: Union[Callable[[resources.File, str], None], None] = None
+  ) -> list[str]:
+    """Uploads `files` concurrently and returns their URLs in the same order.
+
+    Concurrency is bounded by the client's semaphore. Failures are raised
+    together as `errors.BatchUploadError` once every file has been processed.
+    Files with the same content are uploaded only once per batch.
+    """
+    files = [
+        resources.File(file) if isinstance(file, str) else file
+        for file in files
+    ]
+    in_flight: dict[str, asyncio.Task] = {}
+
+    async def upload(source: resources.File, file: resources.File) -> str:
+      url = await self._upload_attachment(file, force_upload, in_flight)
+      if on_complete is not None:
+        on_complete(source, url)
+      return url
+
+    results = await asyncio.gather(
+        *(upload(source, file)
+          for source, file in zip(files, await self._optimize(files))),
+        return_exceptions=True)
+
+    urls: list[Union[str, None]] = []
+    failures = []
+    for i, result in enumerate(results):
+      if isinstance(result, BaseException):
+        if not isinstance(result, Exception):
+          raise result
+        urls.append(None)
+        failures.append((i, result))
+      else:
+        urls.append(result)
+
+    if failures:
+      raise errors.BatchUploadError(failures, urls)
+    return urls
+
+  async def upload_and_render_table(
+      self,
+      df: pd.DataFrame,
+      force_upload=False,
+      minify_markdown=True,
+      journal: Union[str, journal_lib.BatchJournal, None] = None) -> str:
+    cells = team.collect_file_cells(df)
+
+    # The journal and the files it checks are read and written in an
+    # executor, like the attachment cache.
+    loop = asyncio.get_running_loop()
+    with journal_lib.open_journal(journal) as batch_journal:
+      urls, pending = await loop.run_in_executor(None, journal_lib.resume,
+                                                 batch_journal, cells,
+                                                 self.team_name,
+                                                 self.hash_algorithm)
+      if pending:
+        import tqdm  # pylint: disable=import-outside-toplevel
+
+        record = None
+        if batch_journal is not None:
+          record = journal_lib.make_recorder(batch_journal, cells, pending,
+                                             self.team_name,
+                                             self.hash_algorithm)
+
+        writes: list[asyncio.Future] = []
+        with tqdm.tqdm(total=len(cells),
+                       initial=len(cells) - len(pending)) as pbar:
+
+          def update_progress(file: resources.File, url: str):
+            if record is not None:
+              writes.append(loop.run_in_executor(None, record, file, url))
+            pbar.set_description(f'Uploaded {file.name}')
+            pbar.update(1)
+
+          try:
+            pending_urls = await self.upload_attachments(
+                [cells[k][2] for k in pending],
+                force_upload=force_upload,
+                on_complete=update_progress)
+          except errors.BatchUploadError as e:
+            team.expand_failures(e, pending, urls)
+            if batch_journal is not None:
+              writes.append(
+                  loop.run_in_executor(None, journal_lib.record_failures,
+                                       batch_journal, cells, e.failures,
+                                       self.team_name, self.hash_algorithm))
+            team.locate_failures(df, cells, e)
+            raise
+          finally:
+            # Finish the writes before the journal is closed.
+            await asyncio.gather(*writes)
+        for k, url in zip(pending, pending_urls):
+          urls[k] = url
+
+    with self.instrumentation.span(metrics.PHASE_RENDER):
+      return team.render_table(df, cells, urls, minify_markdown)
+
+  def iter_posts(self,
+                 q: Union[str, None] = None,
+                 include: Union[str, None] = None,
+                 sort: Union[str, None] = None,
+                 order: Union[str, None] = None,
+                 per_page: int = team.MAX_PER_PAGE,
+                 prefetch: bool = True) -> AsyncIterator[dict]:
+    """Yields the posts of the team that match `q`, as `async for` items."""
+    params = team.build_list_params(q=q,
+                                    include=include,
+                                    sort=sort,
+                                    order=order,
+                                    per_page=per_page)
+
+    async def fetch_page(page: int) -> dict:
+      return await self.client.get_request(f'v1/teams/{self.team_name}/posts',
+                                           query_params={
+                                               **params, 'page': page
+                                           })
+
+    return iter_pages(fetch_page, 'posts', prefetch)
+
+  async def _optimize(self,
+                      files: list[resources.File]) -> list[resources.File]:
+    if self.image_optimizer is None:
+      return files
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(None, self.image_optimizer.optimize,
+                                         files)
+    return [result.file for result in results]
+
+  async def _upload_attachment(self, file: resources.File, force_upload: bool,
+                               in_flight: dict[str, asyncio.Task]) -> str:
+    loop = asyncio.get_running_loop()
+    # Hashing reads the whole file, so keep it off the event loop.
+    if not file.is_hashed(self.hash_algorithm):
+      with self.instrumentation.span(metrics.PHASE_HASH,
+                                     target=file.path,
+                                     num_bytes=file.size):
+        await loop.run_in_executor(None, file.hash, self.hash_algorithm)
+
+    if not force_upload:
+      # The cache may be a SQLite file, so it is also used in an executor.
+      with self.instrumentation.span(metrics.PHASE_CACHE_LOOKUP,
+                                     target=file.path) as span:
+        cached_url = await loop.run_in_executor(None, team.lookup_cached_url,
+                                                self.cache_storage,
+                                                self.team_name, file,
+                                                self.hash_algorithm)
+        span.cache_hit = bool(cached_url)
+      if cached_url:
+        return cached_url
+
+    # Files with the same content share the task of the first one.
+    cache_key = team.build_cache_key(self.team_name, file, self.hash_algorithm)
+    task = in_flight.get(cache_key)
+    if task is None:
+      task = asyncio.ensure_future(self._upload_uncached(file, cache_key))
+      in_flight[cache_key] = task
+    return await asyncio.shield(task)
+
+  async def _upload_uncached(self, file: resources.File, cache_key: str) -> str:
+    policies = await self._fetch_attachment_policies(file)
+    resource_url = await self._do_upload_attachment(policies, file)
+    with self.instrumentation.span(metrics.PHASE_CACHE_STORE):
+      await asyncio.get_running_loop().run_in_executor(None,
+                                                       self.cache_storage.set,
+                                                       cache_key, resource_url)
+    return resource_url
+
+  async def _fetch_attachment_policies(self, file: resources.File):
+    params = team.build_policies_params(file)
+    with self.instrumentation.span(metrics.PHASE_POLICIES, target=file.path):
+      # Policies are only handed out, so asking again is harmless.
+      response = await self.client.post_request(
+          f'v1/teams/{self.team_name}/attachments/policies',
+          body=params,
+          idempotent=True,
+      )
+    return response
+
+  async def _do_upload_attachment(self, policies: dict,
+                                  file: resources.File) -> str:
+    endpoint, fields = team.build_s3_fields(policies, file)
+    body = multipart.MultipartEncoder(fields)
+    headers = {
+        'Content-Type': body.content_type,
+        'Content-Length': str(len(body)),
+    }
+    with self.instrumentation.span(metrics.PHASE_S3,
+                                   target=file.path,
+                                   num_bytes=file.size) as span:
+      # The policy fixes the object key, so an upload sent twice stores the
+      # same object.
+      response, content = await self.client.request(endpoint,
+                                                    'POST',
+                                                    body=body,
+                                                    headers=headers,
+                                                    idempotent=True)
+      span.status = response.status
+      response, _ = team.parse_s3_response(endpoint, response, content)
+    return team.get_resource_url(response)
@@ -1,64 +1,105 @@
 from __future__ import annotations
 
+import base64
+import collections
+import concurrent.futures
+import datetime
+import functools
+import hashlib
 import json
-from typing import Union
+import queue
+import threading
+import time
+from typing import Callable, Iterator, Sequence, TYPE_CHECKING, Union
 import urllib.parse
 
-import httplib2
-import pandas as pd
-import tqdm
-
 from esap import errors
+from esap import journal as journal_lib
+from esap import metrics
+from esap import multipart
 from esap import resources
 from esap import storage
+from esap import transport
 from esap.base import BaseClient
 from esap.markdown import embedding
 from esap.markdown import table
 from esap.services import base
 
-CACHE_STORAGE = storage.LocalFileStorage('~/.esap/attachments_cache')
+if TYPE_CHECKING:
+  import pandas as pd
 
-BOUNDARY = '-------314159265358979323846'
-CRLF = b'\r\n'
+  from esap import images
 
+# Policies that expire within this many seconds are fetched again before the
+# upload starts.
+POLICY_EXPIRY_MARGIN = 60.0
 
-def _encode_multipart_form_fata(fields: dict[str, Union[str, resources.File]]):
-  lines = []
-  for key, value in fields.items():
-    lines.append(f'--{BOUNDARY}')
-    if isinstance(value, resources.File):
-      lines.append(f'Content-Disposition: form-data; name="{key}"; '
-                   f'filename="{value.name}"')
-      lines.append(f'Content-Type: {value.mimetype}')
-      lines.append('')
-      lines.append(value.read())
-    else:
-      lines.append(f'Content-Disposition: form-data; name="{key}"')
-      lines.append('')
-      lines.append(value)
-  lines.append('--' + BOUNDARY + '--')
-  lines.append('')
-  lines = [
-      line.encode('utf-8') if isinstance(line, str) else line for line in lines
-  ]
-  body = CRLF.join(lines)
-  content_type = f'multipart/form-data; boundary={BOUNDARY}'
-  return content_type, body
+CACHE_STORAGE_PATH = '~/.esap/attachments_cache.db'
+LEGACY_CACHE_STORAGE_PATH = '~/.esap/attachments_cache'
+POST_STORAGE_PATH = '~/.esap/posts.db'
+# The largest page size esa accepts.
+MAX_PER_PAGE = 100
+# Number of files whose URLs each `TeamService` remembers by their stat.
+URL_MEMO_SIZE = 65536
+
+_cache_storage_lock = threading.Lock()
+_cache_storage: Union[storage.BaseStorage, None] = None
+_post_storage: Union[storage.BaseStorage, None] = None
+
+
+def get_cache_storage() -> storage.BaseStorage:
+  """Returns the default attachment cache, opening it on first use."""
+  global _cache_storage
+  if _cache_storage is None:
+    with _cache_storage_lock:
+      if _cache_storage is None:
+        _cache_storage = storage.SqliteStorage(
+            CACHE_STORAGE_PATH, migrate_from=LEGACY_CACHE_STORAGE_PATH)
+  return _cache_storage
+
+
+def get_post_storage() -> storage.BaseStorage:
+  """Returns the default record of written posts, opening it on first use."""
+  global _post_storage
+  if _post_storage is None:
+    with _cache_storage_lock:
+      if _post_storage is None:
+        _post_storage = storage.SqliteStorage(POST_STORAGE_PATH)
+  return _post_storage
 
 
-def _post_s3_request(endpoint: str, fields: dict[str, Union[str,
-                                                            resources.File]]):
-  content_type, body = _encode_multipart_form_fata(fields)
-  headers = {'Content-Type': content_type}
+def __getattr__(name: str):
+  # `CACHE_STORAGE` and `POST_STORAGE` are created lazily to keep
+  # `import esap` cheap.
+  if name == 'CACHE_STORAGE':
+    return get_cache_storage()
+  if name == 'POST_STORAGE':
+    return get_post_storage()
+  raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
-  http = httplib2.Http()
+
+def _post_s3_request(http: transport.HttpPool, endpoint: str,
+                     fields: dict[str, Union[str, resources.File]]):
+  body = multipart.MultipartEncoder(fields)
+  headers = {
+      'Content-Type': body.content_type,
+      'Content-Length': str(len(body)),
+  }
+
+  # The policy fixes the object key, so an upload sent twice stores the same
+  # object.
   response, content = http.request(
       endpoint,
       'POST',
       body=body,
       headers=headers,
+      idempotent=True,
   )
 
+  return parse_s3_response(endpoint, response, content)
+
+
+def parse_s3_response(endpoint: str, response, content: bytes):
   if response.status < 300:
     if response.status == 204:
       return response, {}
@@ -67,76 +108,888 @@ def _post_s3_request(endpoint: str, fields: dict[str, Union[str,
     raise errors.HttpError(response, content, uri=endpoint)
 
 
-def _do_upload_attachment(policies: dict, file: resources.File) -> str:
-  params = policies['form']
-  params['file'] = file
-  response, _ = _post_s3_request(
-      policies['attachment']['endpoint'],
-      params,
-  )
+def build_s3_fields(policies: dict, file: resources.File):
+  # A copy, so that the policies can be used again.
+  fields = dict(policies['form'])
+  fields['file'] = file
+  return policies['attachment']['endpoint'], fields
+
+
+def get_resource_url(response) -> str:
   return urllib.parse.unquote(response['location'], encoding='utf-8')
 
 
+def get_policy_expiration(policies: dict) -> Union[float, None]:
+  """Returns the expiration time of an S3 upload policy as a timestamp."""
+  try:
+    policy = json.loads(base64.b64decode(policies['form']['policy']))
+    expiration = policy['expiration'].replace('Z', '+00:00')
+    return datetime.datetime.fromisoformat(expiration).timestamp()
+  except (KeyError, TypeError, ValueError):
+    return None
+
+
+def _is_policy_expired(policies: dict) -> bool:
+  expiration = get_policy_expiration(policies)
+  if expiration is None:
+    return False
+  return expiration - POLICY_EXPIRY_MARGIN < time.time()
+
+
+def _is_policy_expired_error(error: errors.HttpError) -> bool:
+  return error.status_code == 403 and b'expired' in error.content.lower()
+
+
+def _do_upload_attachment(http: transport.HttpPool, policies: dict,
+                          file: resources.File,
+                          instrumentation: metrics.Instrumentation) -> str:
+  endpoint, params = build_s3_fields(policies, file)
+  with instrumentation.span(metrics.PHASE_S3,
+                            target=file.path,
+                            num_bytes=file.size) as span:
+    response, _ = _post_s3_request(http, endpoint, params)
+    span.status = response.status
+  return get_resource_url(response)
+
+
+def build_cache_key(team_name: str,
+                    file: resources.File,
+                    algorithm: str = resources.HASH_ALGORITHM) -> str:
+  # Keyed on content only, so that the same bytes under different names share
+  # one upload. The name is applied when the attachment is rendered.
+  return f'{team_name}:{algorithm}:{file.hash(algorithm)}:{file.size}'
+
+
+def _build_legacy_cache_key(team_name: str, file: resources.File) -> str:
+  return f'{team_name}:{file.name}:{file.hash()}'
+
+
+def lookup_cached_url(
+    cache_storage: storage.BaseStorage,
+    team_name: str,
+    file: resources.File,
+    algorithm: str = resources.HASH_ALGORITHM) -> Union[str, None]:
+  cache_key = build_cache_key(team_name, file, algorithm)
+  cached_url = cache_storage.get(cache_key)
+  if cached_url or algorithm != resources.HASH_ALGORITHM:
+    return cached_url
+  # Entries written before keys were content-addressed.
+  cached_url = cache_storage.get(_build_legacy_cache_key(team_name, file))
+  if cached_url:
+    cache_storage.set(cache_key, cached_url)
+  return cached_url
+
+
+def build_post_params(name: Union[str, None] = None,
+                      body_md: Union[str, None] = None,
+                      tags: Union[Sequence[str], None] = None,
+                      category: Union[str, None] = None,
+                      wip: Union[bool, None] = None,
+                      message: Union[str, None] = None) -> dict:
+  params = {
+      'name': name,
+      'body_md': body_md,
+      'tags': list(tags) if tags is not None else None,
+      'category': category.strip('/') if category is not None else None,
+      'wip': wip,
+      'message': message,
+  }
+  return {key: value for key, value in params.items() if value is not None}
+
+
+def digest_post_params(params: dict) -> str:
+  # The message only describes the revision, so it is not part of the content.
+  content = {key: value for key, value in params.items() if key != 'message'}
+  data = json.dumps(content, ensure_ascii=False, sort_keys=True)
+  return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def _build_post_digest_key(team_name: str, number: int) -> str:
+  return f'{team_name}:post:{number}'
+
+
+def _build_post_number_key(team_name: str, name: str,
+                           category: Union[str, None]) -> str:
+  category = (category or '').strip('/')
+  full_name = f'{category}/{name}' if category else name
+  return f'{team_name}:post_number:{full_name}'
+
+
+def build_list_params(**params) -> dict:
+  return {key: value for key, value in params.items() if value is not None}
+
+
+def iter_pages(fetch_page: Callable[[int], dict],
+               key: str,
+               prefetch: bool = True) -> Iterator[dict]:
+  """Yields the items under `key` of the pages of a list endpoint.
+
+  `fetch_page` returns a page by its number, starting at 1, and the pages are
+  followed by their `next_page`. With `prefetch`, the next page is fetched by a
+  background thread while the items of the current one are consumed. Only
+  that page is fetched when the iteration stops early.
+  """
+  if not prefetch:
+    page = 1
+    while page is not None:
+      response = fetch_page(page)
+      page = response.get('next_page')
+      yield from response[key]
+    return
+
+  executor = concurrent.futures.ThreadPoolExecutor(
+      1, thread_name_prefix='esap-page')
+  future = None
+  try:
+    future = executor.submit(fetch_page, 1)
+    while future is not None:
+      response = future.result()
+      next_page = response.get('next_page')
+      future = executor.submit(fetch_page, next_page) if next_page else None
+      yield from response.pop(key)
+  finally:
+    if future is not None:
+      future.cancel()
+    executor.shutdown(wait=False)
+
+
+def build_policies_params(file: resources.File) -> dict:
+  return {
+      'type': file.mimetype,
+      'name': file.name,
+      'size': file.size,
+  }
+
+
+def collect_file_cells(df: pd.DataFrame):
+  """Returns `(row, column, file)` positions of the files in `df`."""
+  cells = []
+  # One conversion instead of an indexed lookup per cell.
+  for i, row in enumerate(df.to_numpy(dtype=object)):
+    for j, value in enumerate(row):
+      if isinstance(value, resources.File):
+        cells.append((i, j, value))
+  return cells
+
+
+def locate_failures(df: pd.DataFrame, cells: list,
+                    error: errors.BatchUploadError):
+  """Replaces batch indices in `error` with DataFrame coordinates."""
+  error.failures = [((df.index[cells[k][0]], df.columns[cells[k][1]]),
+                     exception) for k, exception in error.failures]
+
+
+def expand_failures(error: errors.BatchUploadError, pending: Sequence[int],
+                    urls: list[Union[str, None]]):
+  """Maps batch indices in `error` from the pending cells to all cells."""
+  results = list(urls)
+  for k, url in zip(pending, error.results):
+    results[k] = url
+  error.failures = [(pending[k], exception) for k, exception in error.failures]
+  error.results = results
+
+
+def render_table(df: pd.DataFrame, cells: list, urls: list[str],
+                 minify_markdown: bool) -> str:
+  if minify_markdown:
+    return table.write_markdown_table(df,
+                                      overrides={
+                                          (i, j): embedding.render(file, url)
+                                          for (i, j,
+                                               file), url in zip(cells, urls)
+                                      })
+
+  if cells:
+    df = df.copy()
+    for (i, j, file), url in zip(cells, urls):
+      df.iat[i, j] = embedding.render(file, url)
+
+  return df.to_markdown()
+
+
+class _InFlightUploads(object):
+  """Shares one upload among the files of a batch with the same content."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._futures: dict[str, concurrent.futures.Future] = {}
+
+  def run(self, key: str, upload: Callable[[], str]) -> str:
+    with self._lock:
+      future = self._futures.get(key)
+      is_owner = future is None
+      if is_owner:
+        future = concurrent.futures.Future()
+        self._futures[key] = future
+    if not is_owner:
+      return future.result()
+
+    try:
+      url = upload()
+    except BaseException as e:
+      future.set_exception(e)
+      raise
+    future.set_result(url)
+    return url
+
+
+class _UploadPipeline(object):
+  """Fetches upload policies and uploads files in two concurrent stages.
+
+  Policy workers hash each file, look it up in the cache and fetch a policy for
+  it. Upload workers take the policies from a bounded queue and send the files
+  to S3, so that policies for upcoming files are fetched while earlier files
+  are still transferring. Files with the same content wait for the first one
+  instead of being uploaded again.
+  """
+
+  def __init__(self, hash_file: Callable[[resources.File], str],
+               lookup_cache: Union[Callable[[resources.File], Union[str, None]],
+                                   None],
+               cache_key_of: Callable[[resources.File], str],
+               fetch_policies: Callable[[resources.File], dict],
+               upload: Callable[[resources.File, dict],
+                                str], store_cache: Callable[[str, str], None],
+               policy_workers: int, upload_workers: int, queue_size: int,
+               on_complete: Union[Callable[[resources.File, str], None], None]):
+    self._hash_file = hash_file
+    self._lookup_cache = lookup_cache
+    self._cache_key_of = cache_key_of
+    self._fetch_policies = fetch_policies
+    self._upload = upload
+    self._store_cache = store_cache
+    self._policy_workers = policy_workers
+    self._upload_workers = upload_workers
+    self._on_complete = on_complete
+    self._queue = queue.Queue(maxsize=queue_size)
+    self._lock = threading.Lock()
+    self._owners: dict[str, concurrent.futures.Future] = {}
+    self._files: list[resources.File] = []
+    self._results: list[concurrent.futures.Future] = []
+
+  def run(self, files: list[resources.File]) -> list[concurrent.futures.Future]:
+    self._files = files
+    self._results = [concurrent.futures.Future() for _ in files]
+    uploaders = [
+        threading.Thread(target=self._upload_loop, daemon=True)
+        for _ in range(self._upload_workers)
+    ]
+    for uploader in uploaders:
+      uploader.start()
+    try:
+      with concurrent.futures.ThreadPoolExecutor(
+          self._policy_workers) as executor:
+        for i in range(len(files)):
+          executor.submit(self._prepare, i)
+    finally:
+      for _ in uploaders:
+        self._queue.put(None)
+      for uploader in uploaders:
+        uploader.join()
+    return self._results
+
+  def _prepare(self, i: int):
+    file = self._files[i]
+    try:
+      self._hash_file(file)
+      if self._lookup_cache is not None:
+        cached_url = self._lookup_cache(file)
+        if cached_url:
+          self._resolve(i, cached_url)
+          return
+
+      cache_key = self._cache_key_of(file)
+      with self._lock:
+        owner = self._owners.get(cache_key)
+        if owner is None:
+          self._owners[cache_key] = self._results[i]
+      if owner is not None:
+        owner.add_done_callback(functools.partial(self._copy_result, i))
+        return
+
+      policies = self._fetch_policies(file)
+    except Exception as e:  # pylint: disable=broad-except
+      self._results[i].set_exception(e)
+      return
+    # Blocks while the upload workers are behind.
+    self._queue.put((i, cache_key, policies))
+
+  def _upload_loop(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        return
+      i, cache_key, policies = item
+      try:
+        url = self._upload(self._files[i], policies)
+        self._store_cache(cache_key, url)
+      except Exception as e:  # pylint: disable=broad-except
+        self._results[i].set_exception(e)
+        continue
+      self._resolve(i, url)
+
+  def _resolve(self, i: int, url: str):
+    if self._on_complete is not None:
+      try:
+        self._on_complete(self._files[i], url)
+      except Exception as e:  # pylint: disable=broad-except
+        self._results[i].set_exception(e)
+        return
+    self._results[i].set_result(url)
+
+  def _copy_result(self, i: int, owner: concurrent.futures.Future):
+    exception = owner.exception()
+    if exception is not None:
+      self._results[i].set_exception(exception)
+    else:
+      self._resolve(i, owner.result())
+
+
+def upload_to_teams(
+    services: Sequence[TeamService],
+    files: Sequence[Union[str, resources.File]],
+    force_upload=False,
+    max_workers: Union[int, None] = None,
+    hash_workers: Union[int, None] = None,
+    image_optimizer: Union[images.ImageOptimizer, None] = None,
+    on_complete: Union[Callable[[str, resources.File, str], None], None] = None
+) -> dict[str, list[str]]:
+  """Uploads `files` to the team of every service concurrently.
+
+  The files are optimized by `image_optimizer` and hashed once for all teams,
+  by `hash_workers` threads. Each team then runs its own batch with
+  `max_workers` as in `TeamService.upload_attachments`, looking up and filling
+  its own cache entries. The batches go through the files in the same order,
+  so a file read for one team is usually still in the page cache for the
+  others. `on_complete` is called with the team name, the file and its URL.
+
+  Returns the URLs of the files in the same order, per team name. Failures are
+  raised together as `errors.FanOutUploadError` once every team has finished.
+  """
+  team_names = [service.team_name for service in services]
+  if len(set(team_names)) != len(team_names):
+    raise ValueError(f'Each team may appear only once: {team_names}')
+  files = [
+      resources.File(file) if isinstance(file, str) else file for file in files
+  ]
+  sources = files
+  if image_optimizer is not None:
+    files = [result.file for result in image_optimizer.optimize(files)]
+  hashers = {service.hash_algorithm: service for service in services}
+  for service in hashers.values():
+    service._hash_files(files, hash_workers)  # pylint: disable=protected-access
+
+  # The optimized copies are reported as the files that were passed in.
+  sources_by_id = {id(file): source for file, source in zip(files, sources)}
+
+  def upload(service: TeamService) -> list[str]:
+
+    def report(file: resources.File, url: str):
+      on_complete(service.team_name, sources_by_id[id(file)], url)
+
+    return service.upload_attachments(
+        files,
+        force_upload=force_upload,
+        max_workers=max_workers,
+        on_complete=report if on_complete is not None else None)
+
+  results: dict[str, list] = {}
+  failures: dict[str, Exception] = {}
+  with concurrent.futures.ThreadPoolExecutor(len(services) or 1) as executor:
+    futures = {
+        service.team_name: executor.submit(upload, service)
+        for service in services
+    }
+    for team_name, future in futures.items():
+      try:
+        results[team_name] = future.result()
+      except errors.BatchUploadError as e:
+        results[team_name] = e.results
+        failures[team_name] = e
+      except Exception as e:  # pylint: disable=broad-except
+        results[team_name] = [None] * len(files)
+        failures[team_name] = e
+
+  if failures:
+    raise errors.FanOutUploadError(failures, results)
+  return results
+
+
 class TeamService(base.Service):
 
-  def __init__(self, client: BaseClient, team_name: str):
+  def __init__(self,
+               client: BaseClient,
+               team_name: str,
+               cache_storage: Union[storage.BaseStorage, None] = None,
+               image_optimizer: Union[images.ImageOptimizer, None] = None,
+               hash_algorithm: str = resources.HASH_ALGORITHM,
+               post_storage: Union[storage.BaseStorage, None] = None):
     super(TeamService, self).__init__(client)
     self.team_name = team_name
+    self._cache_storage = cache_storage
+    self._post_storage = post_storage
+    # Applied to every file before it is hashed and uploaded.
+    self.image_optimizer = image_optimizer
+    # Identifies file contents in the cache; part of every cache key.
+    resources.check_hash_algorithm(hash_algorithm)
+    self.hash_algorithm = hash_algorithm
+    self.http = client.http
+    if self.http is None:
+      self.http = transport.HttpPool()
+    self.instrumentation = client.instrumentation
+    if self.instrumentation is None:
+      self.instrumentation = metrics.Instrumentation()
+    # URLs of the files uploaded by `upload_and_render_table`, by their stat
+    # key, hash algorithm and image options, so that unchanged cells are not
+    # hashed or looked up again.
+    self._urls_by_stat: collections.OrderedDict = collections.OrderedDict()
+    self._urls_by_stat_lock = threading.Lock()
+
+  @property
+  def cache_storage(self) -> storage.BaseStorage:
+    if self._cache_storage is None:
+      return get_cache_storage()
+    return self._cache_storage
+
+  @property
+  def post_storage(self) -> storage.BaseStorage:
+    if self._post_storage is None:
+      return get_post_storage()
+    return self._post_storage
 
   def upload_attachment(self,
                         file: Union[str, resources.File],
                         force_upload=False) -> str:
     if isinstance(file, str):
       file = resources.File(file)
+    if self.image_optimizer is not None:
+      file = self.image_optimizer.optimize([file])[0].file
+    return self._upload_attachment(file, force_upload, _InFlightUploads())
 
-    cache_key = f'{self.team_name}:{file.name}:{file.hash()}'
-    cached_url = CACHE_STORAGE.get(cache_key)
-    if cached_url and not force_upload:
-      return cached_url
+  def upload_attachments(self,
+                         files: Sequence[Union[str, resources.File]],
+                         force_upload=False,
+                         max_workers: Union[int, None] = None,
+                         on_complete: Union[Callable[[resources.File, str],
+                                                     None], None] = None,
+                         policy_workers: Union[int, None] = None,
+                         upload_workers: Union[int, None] = None,
+                         queue_size: Union[int, None] = None,
+                         hash_workers: Union[int, None] = None) -> list[str]:
+    """Uploads `files` and returns their URLs in the same order.
 
-    policies = self._fetch_attachment_policies(file)
-    resource_url = _do_upload_attachment(policies, file)
-    CACHE_STORAGE.set(cache_key, resource_url)
-    return resource_url
+    The files are first hashed in parallel by `hash_workers` threads (as many
+    as `ThreadPoolExecutor` starts by default) with `hash_algorithm`.
+
+    With more than one worker, uploads run as a two-stage pipeline:
+    `policy_workers` threads hash the files and fetch their upload policies
+    from esa while `upload_workers` threads send the files to S3. Both default
+    to `max_workers`. At most `queue_size` fetched policies wait for an upload
+    worker (`upload_workers` by default). Policies that expire before their
+    upload starts are fetched again.
+
+    Failures do not stop the batch; they are raised together as
+    `errors.BatchUploadError` once every file has been processed. Files with
+    the same content are uploaded only once per batch.
+    """
+    files = [
+        resources.File(file) if isinstance(file, str) else file
+        for file in files
+    ]
+    if self.image_optimizer is not None:
+      sources = files
+      files = [result.file for result in self.image_optimizer.optimize(files)]
+      if on_complete is not None:
+        # Report the files that were passed in, not the optimized copies.
+        sources_by_id = {
+            id(file): source for file, source in zip(files, sources)
+        }
+        report = on_complete
+
+        def report_source(file: resources.File, url: str):
+          report(sources_by_id[id(file)], url)
+
+        on_complete = report_source
+    self._hash_files(files, hash_workers)
+
+    urls: list[Union[str, None]] = [None] * len(files)
+    failures = []
+    pipelined = any(n is not None and n > 1
+                    for n in (max_workers, policy_workers, upload_workers))
+    if not pipelined:
+      in_flight = _InFlightUploads()
+      for i, file in enumerate(files):
+        try:
+          urls[i] = self._upload_attachment(file, force_upload, in_flight)
+          if on_complete is not None:
+            on_complete(file, urls[i])
+        except Exception as e:  # pylint: disable=broad-except
+          urls[i] = None
+          failures.append((i, e))
+    else:
+      if policy_workers is None:
+        policy_workers = max_workers or 1
+      if upload_workers is None:
+        upload_workers = max_workers or 1
+      if queue_size is None:
+        queue_size = upload_workers
+
+      lookup_cache = None
+      if not force_upload:
+        lookup_cache = self._lookup_cache
+      pipeline = _UploadPipeline(hash_file=self._hash_file,
+                                 lookup_cache=lookup_cache,
+                                 cache_key_of=self._build_cache_key,
+                                 fetch_policies=self._fetch_attachment_policies,
+                                 upload=self._upload_with_policies,
+                                 store_cache=self._store_cache,
+                                 policy_workers=policy_workers,
+                                 upload_workers=upload_workers,
+                                 queue_size=queue_size,
+                                 on_complete=on_complete)
+      for i, future in enumerate(pipeline.run(files)):
+        exception = future.exception()
+        if exception is not None:
+          failures.append((i, exception))
+        else:
+          urls[i] = future.result()
+
+    if failures:
+      raise errors.BatchUploadError(failures, urls)
+    return urls
 
   def upload_and_render_table(self,
                               df: pd.DataFrame,
                               force_upload=False,
-                              minify_markdown=True) -> str:
-    num_files = 0
-    for _, row in df.iterrows():
-      for _, value in row.items():
-        if isinstance(value, resources.File):
-          num_files += 1
+                              minify_markdown=True,
+                              max_workers: Union[int, None] = None,
+                              policy_workers: Union[int, None] = None,
+                              upload_workers: Union[int, None] = None,
+                              queue_size: Union[int, None] = None,
+                              journal: Union[str, journal_lib.BatchJournal,
+                                             None] = None,
+                              hash_workers: Union[int, None] = None,
+                              on_complete: Union[Callable[[resources.File, str],
+                                                          None], None] = None,
+                              show_progress: bool = True) -> str:
+    """Uploads the files in `df` and renders it as a markdown table.
+
+    `on_complete` is called with every file that is uploaded, and the progress
+    is shown on stderr unless `show_progress` is False.
 
-    if num_files > 0:
-      with tqdm.tqdm(total=num_files) as pbar:
+    If `journal` (a path or a `BatchJournal`) is given, every finished cell is
+    recorded in it. Running the same table again with the journal skips the
+    recorded cells and renders the same markdown.
 
-        def render_if_file(value):
-          if not isinstance(value, resources.File):
-            return value
-          pbar.set_description(f'Uploading {value.name}')
-          url = self.upload_attachment(value, force_upload)
-          pbar.update(1)
-          return embedding.render(value, url)
+    The service remembers the URL of every file it uploads here by the path,
+    size, mtime and inode of the file. When a table is rendered again, only
+    the cells whose files changed are hashed and uploaded, unless
+    `force_upload` is set.
+    """
+    cells = collect_file_cells(df)
 
-        df = df.applymap(render_if_file)
+    with journal_lib.open_journal(journal) as batch_journal:
+      urls, pending = journal_lib.resume(batch_journal, cells, self.team_name,
+                                         self.hash_algorithm)
+      memo_keys = {
+          id(cells[k][2]): self._build_memo_key(cells[k][2]) for k in pending
+      }
+      if not force_upload:
+        pending = self._resolve_remembered_urls(cells, pending, memo_keys, urls,
+                                                batch_journal)
+      if pending:
+        import tqdm  # pylint: disable=import-outside-toplevel
 
-    md = df.to_markdown()
+        record = None
+        if batch_journal is not None:
+          record = journal_lib.make_recorder(batch_journal, cells, pending,
+                                             self.team_name,
+                                             self.hash_algorithm)
 
-    if minify_markdown:
-      md = table.minify_markdown_table(md)
+        with tqdm.tqdm(total=len(cells),
+                       initial=len(cells) - len(pending),
+                       disable=not show_progress) as pbar:
 
-    return md
+          def update_progress(file: resources.File, url: str):
+            if record is not None:
+              record(file, url)
+            self._remember_url(memo_keys[id(file)], url)
+            if on_complete is not None:
+              on_complete(file, url)
+            pbar.set_description(f'Uploaded {file.name}')
+            pbar.update(1)
+
+          try:
+            pending_urls = self.upload_attachments(
+                [cells[k][2] for k in pending],
+                force_upload=force_upload,
+                max_workers=max_workers,
+                on_complete=update_progress,
+                policy_workers=policy_workers,
+                upload_workers=upload_workers,
+                queue_size=queue_size,
+                hash_workers=hash_workers)
+          except errors.BatchUploadError as e:
+            expand_failures(e, pending, urls)
+            if batch_journal is not None:
+              journal_lib.record_failures(batch_journal, cells, e.failures,
+                                          self.team_name, self.hash_algorithm)
+            locate_failures(df, cells, e)
+            raise
+        for k, url in zip(pending, pending_urls):
+          urls[k] = url
+
+    with self.instrumentation.span(metrics.PHASE_RENDER):
+      return render_table(df, cells, urls, minify_markdown)
+
+  def create_post(self,
+                  name: str,
+                  body_md: Union[str, None] = None,
+                  tags: Union[Sequence[str], None] = None,
+                  category: Union[str, None] = None,
+                  wip: Union[bool, None] = None,
+                  message: Union[str, None] = None) -> dict:
+    """Creates a post and returns it as esa describes it."""
+    params = build_post_params(name, body_md, tags, category, wip, message)
+    post = self.client.post_request(f'v1/teams/{self.team_name}/posts',
+                                    body={'post': params})
+    self.post_storage.set(
+        _build_post_digest_key(self.team_name, post['number']),
+        digest_post_params(params))
+    return post
+
+  def update_post(self,
+                  number: int,
+                  name: Union[str, None] = None,
+                  body_md: Union[str, None] = None,
+                  tags: Union[Sequence[str], None] = None,
+                  category: Union[str, None] = None,
+                  wip: Union[bool, None] = None,
+                  message: Union[str, None] = None,
+                  force: bool = False) -> Union[dict, None]:
+    """Updates the given fields of post `number` and returns the post.
+
+    A digest of the fields written to each post is kept in `post_storage`. If
+    the same fields were last written with the same values, nothing is sent
+    and None is returned, unless `force` is set. Edits made on esa itself are
+    not noticed.
+    """
+    params = build_post_params(name, body_md, tags, category, wip, message)
+    digest_key = _build_post_digest_key(self.team_name, number)
+    digest = digest_post_params(params)
+    if not force and self.post_storage.get(digest_key) == digest:
+      return None
+    post = self.client.patch_request(
+        f'v1/teams/{self.team_name}/posts/{number}', body={'post': params})
+    self.post_storage.set(digest_key, digest)
+    return post
+
+  def upsert_post(self,
+                  name: str,
+                  body_md: Union[str, None] = None,
+                  tags: Union[Sequence[str], None] = None,
+                  category: Union[str, None] = None,
+                  wip: Union[bool, None] = None,
+                  message: Union[str, None] = None,
+                  force: bool = False) -> Union[dict, None]:
+    """Creates a post, or updates the one created before with this name.
+
+    Posts are matched by `category` and `name` with the numbers recorded in
+    `post_storage` by earlier calls. An unchanged post is skipped as in
+    `update_post`. A recorded post that has been deleted is created again.
+    """
+    number_key = _build_post_number_key(self.team_name, name, category)
+    number = self.post_storage.get(number_key)
+    if number is not None:
+      try:
+        return self.update_post(int(number),
+                                name=name,
+                                body_md=body_md,
+                                tags=tags,
+                                category=category,
+                                wip=wip,
+                                message=message,
+                                force=force)
+      except errors.HttpError as e:
+        if e.status_code != 404:
+          raise
+    post = self.create_post(name, body_md, tags, category, wip, message)
+    self.post_storage.set(number_key, str(post['number']))
+    return post
+
+  def iter_posts(self,
+                 q: Union[str, None] = None,
+                 include: Union[str, None] = None,
+                 sort: Union[str, None] = None,
+                 order: Union[str, None] = None,
+                 per_page: int = MAX_PER_PAGE,
+                 prefetch: bool = True) -> Iterator[dict]:
+    """Yields the posts of the team that match the search query `q`.
+
+    The posts are fetched a page at a time as they are consumed, so that at
+    most two pages are held in memory. See `iter_pages` for `prefetch`.
+    """
+    params = build_list_params(q=q,
+                               include=include,
+                               sort=sort,
+                               order=order,
+                               per_page=per_page)
+    return self._iter_pages(f'v1/teams/{self.team_name}/posts', 'posts', params,
+                            prefetch)
+
+  def iter_comments(self,
+                    post_number: Union[int, None] = None,
+                    per_page: int = MAX_PER_PAGE,
+                    prefetch: bool = True) -> Iterator[dict]:
+    """Yields the comments of post `post_number`, or of the whole team."""
+    endpoint = f'v1/teams/{self.team_name}/comments'
+    if post_number is not None:
+      endpoint = f'v1/teams/{self.team_name}/posts/{post_number}/comments'
+    return self._iter_pages(endpoint, 'comments',
+                            build_list_params(per_page=per_page), prefetch)
+
+  def iter_members(self,
+                   per_page: int = MAX_PER_PAGE,
+                   prefetch: bool = True) -> Iterator[dict]:
+    return self._iter_pages(f'v1/teams/{self.team_name}/members', 'members',
+                            build_list_params(per_page=per_page), prefetch)
+
+  def _iter_pages(self, endpoint: str, key: str, params: dict,
+                  prefetch: bool) -> Iterator[dict]:
+
+    def fetch_page(page: int) -> dict:
+      return self.client.get_request(endpoint,
+                                     query_params={
+                                         **params, 'page': page
+                                     })
+
+    return iter_pages(fetch_page, key, prefetch)
+
+  def _upload_attachment(self, file: resources.File, force_upload: bool,
+                         in_flight: _InFlightUploads) -> str:
+    self._hash_file(file)
+    if not force_upload:
+      cached_url = self._lookup_cache(file)
+      if cached_url:
+        return cached_url
+
+    def upload() -> str:
+      policies = self._fetch_attachment_policies(file)
+      resource_url = self._upload_with_policies(file, policies)
+      self._store_cache(self._build_cache_key(file), resource_url)
+      return resource_url
+
+    return in_flight.run(self._build_cache_key(file), upload)
+
+  def _upload_with_policies(self, file: resources.File, policies: dict) -> str:
+    if _is_policy_expired(policies):
+      policies = self._fetch_attachment_policies(file)
+    try:
+      return _do_upload_attachment(self.http, policies, file,
+                                   self.instrumentation)
+    except errors.HttpError as e:
+      if not _is_policy_expired_error(e):
+        raise
+    # The policy expired in transit; retry once with a fresh one.
+    policies = self._fetch_attachment_policies(file)
+    return _do_upload_attachment(self.http, policies, file,
+                                 self.instrumentation)
 
   def _fetch_attachment_policies(self, file: resources.File):
-    params = {
-        'type': file.mimetype,
-        'name': file.name,
-        'size': file.size,
-    }
-    response = self.client.post_request(
-        f'v1/teams/{self.team_name}/attachments/policies',
-        body=params,
-    )
+    params = build_policies_params(file)
+    with self.instrumentation.span(metrics.PHASE_POLICIES, target=file.path):
+      # Policies are only handed out, so asking again is harmless.
+      response = self.client.post_request(
+          f'v1/teams/{self.team_name}/attachments/policies',
+          body=params,
+          idempotent=True,
+      )
     return response
+
+  def _hash_file(self, file: resources.File) -> str:
+    if not file.is_hashed(self.hash_algorithm):
+      with self.instrumentation.span(metrics.PHASE_HASH,
+                                     target=file.path,
+                                     num_bytes=file.size):
+        file.hash(self.hash_algorithm)
+    return file.hash(self.hash_algorithm)
+
+  def _hash_files(self, files: list[resources.File], max_workers: Union[int,
+                                                                        None]):
+    unhashed = {
+        id(file): file
+        for file in files
+        if not file.is_hashed(self.hash_algorithm)
+    }
+    if len(unhashed) < 2:
+      return
+
+    def hash_file(file: resources.File):
+      try:
+        self._hash_file(file)
+      except OSError:
+        # Reported as the failure of this file when it is uploaded.
+        pass
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+      list(executor.map(hash_file, unhashed.values()))
+
+  def _build_cache_key(self, file: resources.File) -> str:
+    return build_cache_key(self.team_name, file, self.hash_algorithm)
+
+  def _lookup_cache(self, file: resources.File) -> Union[str, None]:
+    with self.instrumentation.span(metrics.PHASE_CACHE_LOOKUP,
+                                   target=file.path) as span:
+      cached_url = lookup_cached_url(self.cache_storage, self.team_name, file,
+                                     self.hash_algorithm)
+      span.cache_hit = bool(cached_url)
+    return cached_url
+
+  def _store_cache(self, cache_key: str, url: str):
+    with self.instrumentation.span(metrics.PHASE_CACHE_STORE):
+      self.cache_storage.set(cache_key, url)
+
+  def _resolve_remembered_urls(
+      self, cells: list, pending: list[int],
+      memo_keys: dict[int, Union[tuple, None]], urls: list[Union[str, None]],
+      batch_journal: Union[journal_lib.BatchJournal, None]) -> list[int]:
+    """Fills in the URLs of unchanged cells and returns the remaining ones."""
+    remaining = []
+    with self._urls_by_stat_lock:
+      for k in pending:
+        i, j, file = cells[k]
+        url = self._urls_by_stat.get(memo_keys[id(file)])
+        if url is None:
+          remaining.append(k)
+          continue
+        self._urls_by_stat.move_to_end(memo_keys[id(file)])
+        urls[k] = url
+        if batch_journal is not None:
+          batch_journal.record(i,
+                               j,
+                               file,
+                               journal_lib.STATE_DONE,
+                               self.team_name,
+                               self.hash_algorithm,
+                               url=url)
+    return remaining
+
+  def _build_memo_key(self, file: resources.File) -> Union[tuple, None]:
+    # The URL of a file also depends on how it is optimized and hashed, and
+    # both can be changed on the service between tables.
+    stat_key = resources.build_stat_key(file)
+    if stat_key is None:
+      return None
+    options_digest = None
+    if self.image_optimizer is not None:
+      options_digest = self.image_optimizer.options.digest()
+    return stat_key + (self.hash_algorithm, options_digest)
+
+  def _remember_url(self, memo_key: Union[tuple, None], url: str):
+    if memo_key is None:
+      return
+    with self._urls_by_stat_lock:
+      self._urls_by_stat[memo_key] = url
+      self._urls_by_stat.move_to_end(memo_key)
+      if len(self._urls_by_stat) > URL_MEMO_SIZE:
+        self._urls_by_stat.popitem(last=False)
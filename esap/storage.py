@@ -1,7 +1,12 @@
 from __future__ import annotations
 
 import abc
+import contextlib
 import os
+import sqlite3
+import threading
+import time
+from typing import Union
 
 
 class BaseStorage(abc.ABC):
@@ -27,31 +32,56 @@ class BaseStorage(abc.ABC):
     pass
 
 
+def _parse_key_value_lines(lines: list[str]) -> dict[str, str]:
+  data = {}
+  for line in lines:
+    key, value = line.split('=', 1)
+    data[key] = value.rstrip('\n')
+  return data
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+  """Opens a SQLite database that can be shared by threads and processes."""
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  conn = sqlite3.connect(path,
+                         timeout=30,
+                         isolation_level=None,
+                         check_same_thread=False)
+  conn.execute('PRAGMA journal_mode=WAL')
+  conn.execute('PRAGMA synchronous=NORMAL')
+  return conn
+
+
 class LocalFileStorage(BaseStorage):
 
   def __init__(self, path: str, secure=False):
     self.path = os.path.abspath(os.path.expanduser(path))
     self.secure = secure
     self.data = self._read()
+    # Guards `data` and the file against concurrent writers in this process.
+    self._lock = threading.Lock()
 
   def get(self, key: str):
     return self.data.get(key)
 
   def set(self, key: str, value: str):
-    if key in self.data or self.secure:
-      self.data[key] = value
-      self._write(self.data)
-    else:
-      self.data[key] = value
-      self._append(key, value)
+    with self._lock:
+      if key in self.data or self.secure:
+        self.data[key] = value
+        self._write(self.data)
+      else:
+        self.data[key] = value
+        self._append(key, value)
 
   def delete(self, key: str):
-    del self.data[key]
-    self._write(self.data)
+    with self._lock:
+      del self.data[key]
+      self._write(self.data)
 
   def set_from_dict(self, data: dict[str, str]):
-    self.data = dict(data)
-    self._write(self.data)
+    with self._lock:
+      self.data = dict(data)
+      self._write(self.data)
 
   def to_dict(self) -> dict[str, str]:
     return dict(self.data)
@@ -67,14 +97,11 @@ class LocalFileStorage(BaseStorage):
     return opener
 
   def _read(self) -> dict[str, str]:
-    data = {}
     try:
       with open(self.path, 'r', encoding='utf-8',
                 opener=self._get_opener()) as f:
         lines = f.readlines()
-      for line in lines:
-        key, value = line.split('=', 1)
-        data[key] = value.rstrip('\n')
+      data = _parse_key_value_lines(lines)
     except FileNotFoundError:
       return {}
 
@@ -119,3 +146,152 @@ class InMemoryStorage(BaseStorage):
 
   def to_dict(self) -> dict[str, str]:
     return dict(self.data)
+
+
+_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL,
+  created_at REAL NOT NULL,
+  accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at);
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value TEXT NOT NULL
+);
+"""
+
+# Access times are refreshed at most this often, so that most lookups do not
+# need a write.
+_ACCESS_TIME_RESOLUTION = 60.0
+
+# Number of inserts between checks against `max_entries`.
+_EVICTION_INTERVAL = 256
+
+
+@contextlib.contextmanager
+def _transaction(conn: sqlite3.Connection):
+  conn.execute('BEGIN IMMEDIATE')
+  try:
+    yield
+  except BaseException:
+    conn.execute('ROLLBACK')
+    raise
+  conn.execute('COMMIT')
+
+
+class SqliteStorage(BaseStorage):
+  """A storage backed by an indexed SQLite table.
+
+  Lookups and inserts touch only the affected row, and writes are
+  transactional, so the storage can be shared by threads and processes. With
+  `max_entries`, the least recently used entries are evicted once the table
+  grows past the limit. With `max_age`, entries older than that many seconds
+  are treated as missing. Entries of a `LocalFileStorage` file at
+  `migrate_from` are imported once.
+  """
+
+  def __init__(self,
+               path: str,
+               max_entries: Union[int, None] = None,
+               max_age: Union[float, None] = None,
+               migrate_from: Union[str, None] = None):
+    self.path = os.path.abspath(os.path.expanduser(path))
+    self.max_entries = max_entries
+    self.max_age = max_age
+    self._lock = threading.Lock()
+    self._inserts_since_eviction = 0
+    self._conn = connect_sqlite(self.path)
+    self._conn.executescript(_SQLITE_SCHEMA)
+    if migrate_from is not None:
+      self._migrate(os.path.abspath(os.path.expanduser(migrate_from)))
+
+  def get(self, key: str):
+    now = time.time()
+    with self._lock:
+      row = self._conn.execute(
+          'SELECT value, created_at, accessed_at FROM entries WHERE key = ?',
+          (key,)).fetchone()
+      if row is None:
+        return None
+      value, created_at, accessed_at = row
+      if self.max_age is not None and created_at < now - self.max_age:
+        self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        return None
+      if accessed_at < now - _ACCESS_TIME_RESOLUTION:
+        self._conn.execute('UPDATE entries SET accessed_at = ? WHERE key = ?',
+                           (now, key))
+    return value
+
+  def set(self, key: str, value: str):
+    now = time.time()
+    with self._lock:
+      self._conn.execute(
+          'INSERT OR REPLACE INTO entries '
+          '(key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)',
+          (key, value, now, now))
+      self._inserts_since_eviction += 1
+      if self._inserts_since_eviction >= _EVICTION_INTERVAL:
+        self._evict()
+
+  def delete(self, key: str):
+    with self._lock:
+      self._conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+  def set_from_dict(self, data: dict[str, str]):
+    now = time.time()
+    with self._lock, _transaction(self._conn):
+      self._conn.execute('DELETE FROM entries')
+      self._conn.executemany(
+          'INSERT INTO entries (key, value, created_at, accessed_at) '
+          'VALUES (?, ?, ?, ?)', ((k, v, now, now) for k, v in data.items()))
+      self._evict()
+
+  def to_dict(self) -> dict[str, str]:
+    with self._lock:
+      if self.max_age is None:
+        rows = self._conn.execute('SELECT key, value FROM entries')
+      else:
+        rows = self._conn.execute(
+            'SELECT key, value FROM entries WHERE created_at >= ?',
+            (time.time() - self.max_age,))
+      return dict(rows.fetchall())
+
+  def evict(self):
+    """Removes expired entries and entries beyond `max_entries`."""
+    with self._lock:
+      self._evict()
+
+  def close(self):
+    with self._lock:
+      self._conn.close()
+
+  def _evict(self):
+    self._inserts_since_eviction = 0
+    if self.max_age is not None:
+      self._conn.execute('DELETE FROM entries WHERE created_at < ?',
+                         (time.time() - self.max_age,))
+    if self.max_entries is not None:
+      self._conn.execute(
+          'DELETE FROM entries WHERE key IN ('
+          'SELECT key FROM entries ORDER BY accessed_at DESC '
+          'LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+  def _migrate(self, legacy_path: str):
+    with self._lock, _transaction(self._conn):
+      migrated = self._conn.execute('SELECT value FROM meta WHERE key = ?',
+                                    (f'migrated:{legacy_path}',)).fetchone()
+      if migrated is not None:
+        return
+      try:
+        with open(legacy_path, 'r', encoding='utf-8') as f:
+          data = _parse_key_value_lines(f.readlines())
+      except FileNotFoundError:
+        data = {}
+      now = time.time()
+      self._conn.executemany(
+          'INSERT OR IGNORE INTO entries (key, value, created_at, accessed_at) '
+          'VALUES (?, ?, ?, ?)', ((k, v, now, now) for k, v in data.items()))
+      self._conn.execute('INSERT INTO meta (key, value) VALUES (?, ?)',
+                         (f'migrated:{legacy_path}', str(len(data))))
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import collections
+import threading
+from typing import TYPE_CHECKING, Union
+import urllib.parse
+
+from esap import scheduler
+
+if TYPE_CHECKING:
+  import httplib2
+
+
+def _host_key(uri: str) -> str:
+  parsed = urllib.parse.urlsplit(uri)
+  return f'{parsed.scheme}://{parsed.netloc}'
+
+
+class HttpPool(object):
+  """A thread-safe pool of keep-alive connections, kept separately per host.
+
+  `httplib2.Http` keeps its connections open between requests but must not be
+  shared between threads. The pool hands each request an `Http` object of its
+  own, reusing the most recently released one for the same host so that its
+  TCP and TLS session survives across requests. At most
+  `max_connections_per_host` requests run against a host at a time; further
+  requests wait until a connection is released.
+
+  With a `request_scheduler`, requests are paced and retried by it. A
+  connection is held only while a request is on the wire, not while it waits.
+  """
+
+  def __init__(self,
+               max_connections_per_host: int = 16,
+               timeout: Union[float, None] = None,
+               request_scheduler: Union[scheduler.RequestScheduler,
+                                        None] = None):
+    if max_connections_per_host < 1:
+      raise ValueError('`max_connections_per_host` must be positive')
+    self.max_connections_per_host = max_connections_per_host
+    self.timeout = timeout
+    self.request_scheduler = request_scheduler
+    self._condition = threading.Condition()
+    self._idle: dict[str, list[httplib2.Http]] = collections.defaultdict(list)
+    self._num_connections: dict[str, int] = collections.defaultdict(int)
+
+  def request(self,
+              uri: str,
+              method='GET',
+              body=None,
+              headers=None,
+              idempotent: Union[bool, None] = None):
+    """Sends a request. `idempotent` is derived from `method` by default."""
+    if self.request_scheduler is None:
+      return self._request_once(uri, method, body, headers)
+    if idempotent is None:
+      idempotent = method in scheduler.IDEMPOTENT_METHODS
+    return self.request_scheduler.call(
+        uri,
+        lambda: self._request_once(uri, method, body, headers),
+        idempotent=idempotent)
+
+  def _request_once(self, uri: str, method: str, body, headers):
+    host = _host_key(uri)
+    http = self._acquire(host)
+    try:
+      response, content = http.request(uri, method, body=body, headers=headers)
+    except BaseException:
+      # The connection may be in an unknown state, so do not reuse it.
+      self._discard(host, http)
+      raise
+    self._release(host, http)
+    return response, content
+
+  def close(self):
+    """Closes all idle connections."""
+    with self._condition:
+      for host, idle in self._idle.items():
+        for http in idle:
+          http.close()
+        self._num_connections[host] -= len(idle)
+        idle.clear()
+      self._condition.notify_all()
+
+  def _acquire(self, host: str) -> httplib2.Http:
+    with self._condition:
+      while True:
+        idle = self._idle[host]
+        if idle:
+          return idle.pop()
+        if self._num_connections[host] < self.max_connections_per_host:
+          self._num_connections[host] += 1
+          break
+        self._condition.wait()
+    try:
+      import httplib2  # pylint: disable=import-outside-toplevel,redefined-outer-name
+
+      return httplib2.Http(timeout=self.timeout)
+    except BaseException:
+      self._discard(host, None)
+      raise
+
+  def _release(self, host: str, http: httplib2.Http):
+    with self._condition:
+      self._idle[host].append(http)
+      self._condition.notify()
+
+  def _discard(self, host: str, http: Union[httplib2.Http, None]):
+    if http is not None:
+      http.close()
+    with self._condition:
+      self._num_connections[host] -= 1
+      self._condition.notify()
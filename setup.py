@@ -10,19 +10,23 @@ if sys.version_info < (3, 8):
 import io
 import os
 
+from setuptools import find_packages
 from setuptools import setup
 
-packages = ['esap']
+packages = find_packages(include=['esap', 'esap.*'])
 
 install_requires = [
     'httplib2>=0.15.0,<1dev',
-    'lxml>=4.0.0,<5',
     'oauthlib>=3.0.0,<4',
     'pandas>=1.3.0,<2',
     'tabulate>=0.8.10,<1',
     'tqdm>=4.0.0,<5',
 ]
 
+extras_require = {
+    'images': ['Pillow>=9.1.0'],
+}
+
 package_root = os.path.abspath(os.path.dirname(__file__))
 
 readme_filename = os.path.join(package_root, 'README.md')
@@ -46,8 +50,12 @@ setup(
     author_email='kinsei0916@gmail.com',
     url='https://github.com/kon72/esap/',
     install_requires=install_requires,
+    extras_require=extras_require,
     python_requires='>=3.8',
     packages=packages,
+    entry_points={
+        'console_scripts': ['esap=esap.cli:main'],
+    },
     license='Apache 2.0',
     keywords='esa api client',
     classifiers=[
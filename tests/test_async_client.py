@@ -0,0 +1,106 @@
+"""Tests `AsyncEsaClient` and its transport against `benchmarks/fake_esa.py`."""
+from __future__ import annotations
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                 'benchmarks'))
+
+import fake_esa  # pylint: disable=import-error,wrong-import-position
+
+from esap import async_transport  # pylint: disable=wrong-import-position
+from esap import auth  # pylint: disable=wrong-import-position
+from esap import hash_index  # pylint: disable=wrong-import-position
+from esap import storage  # pylint: disable=wrong-import-position
+import esap  # pylint: disable=wrong-import-position
+
+_ACCESS_TOKEN = 'fake-access-token'
+
+
+def setUpModule():  # pylint: disable=invalid-name
+  # The fake server speaks plain HTTP.
+  os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
+
+
+class AsyncClientTest(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.options = fake_esa.FakeEsaOptions(access_token=_ACCESS_TOKEN)
+    self.server = fake_esa.make_server(self.options)
+    thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    thread.start()
+    self.addCleanup(thread.join)
+    self.addCleanup(self.server.server_close)
+    self.addCleanup(self.server.shutdown)
+    self.endpoint_base = f'http://127.0.0.1:{self.server.server_address[1]}/'
+
+    temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, temp_dir)
+    # Keep the digests of the test files out of the user's hash index.
+    index = hash_index.HashIndex(os.path.join(temp_dir, 'hash_index'))
+    hash_index.set_default_index(index)
+    self.addCleanup(index.close)
+    self.addCleanup(hash_index.set_default_index, None)
+    self.path = os.path.join(temp_dir, 'image.png')
+    with open(self.path, 'wb') as f:
+      f.write(os.urandom(300 * 1024))
+
+  def _create_client(self, access_token: str, refresh_token=None):
+    options = auth.AuthOptions(
+        client_secrets_backend='in_memory',
+        client_secrets=auth.ClientSecrets('fake-client-id',
+                                          'fake-client-secret'),
+        credentials_backend='in_memory',
+        credentials=auth.Credentials(access_token=access_token,
+                                     refresh_token=refresh_token))
+    return esap.AsyncEsaClient(options, endpoint_base=self.endpoint_base)
+
+  async def test_request_sends_chunked_body(self):
+    chunks = [b'a' * 1000, b'b' * 2000]
+    response, content = await async_transport.request(
+        self.endpoint_base + 's3',
+        'POST',
+        body=iter(chunks),
+        headers={'Content-Length': '3000'})
+    self.assertEqual(response.status, 204)
+    self.assertEqual(content, b'')
+    self.assertIn('/uploads/', response['location'])
+
+  async def test_request_reads_response(self):
+    response, content = await async_transport.request(self.endpoint_base +
+                                                      'unknown',
+                                                      'POST',
+                                                      body='')
+    self.assertEqual(response.status, 404)
+    self.assertEqual(response['content-type'],
+                     'application/json; charset=utf-8')
+    self.assertIn(b'not_found', content)
+
+  async def test_upload_attachments(self):
+    client = self._create_client(_ACCESS_TOKEN)
+    service = client.team_service('team',
+                                  cache_storage=storage.InMemoryStorage({}))
+    urls = await service.upload_attachments([self.path, self.path])
+    self.assertEqual(len(urls), 2)
+    self.assertEqual(urls[0], urls[1])
+    self.assertTrue(urls[0].startswith('https://files.example.com/uploads/'))
+
+  async def test_refreshes_rejected_token(self):
+    client = self._create_client('stale-access-token',
+                                 refresh_token='fake-refresh-token')
+    service = client.team_service('team',
+                                  cache_storage=storage.InMemoryStorage({}))
+    url = await service.upload_attachment(self.path)
+    self.assertTrue(url.startswith('https://files.example.com/uploads/'))
+    self.assertEqual(client.auth.access_token, _ACCESS_TOKEN)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,37 @@
+"""Tests the image optimization of `esap.images`."""
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+from PIL import ImageCms
+
+from esap import images
+
+
+class OptimizeImageTest(unittest.TestCase):
+
+  def setUp(self):
+    self.temp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.temp_dir)
+
+  def test_keeps_icc_profile_of_jpeg(self):
+    profile = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+    source_path = os.path.join(self.temp_dir, 'source.jpg')
+    Image.new('RGB', (64, 48), (200, 30, 30)).save(source_path,
+                                                   icc_profile=profile)
+    output_path = os.path.join(self.temp_dir, 'output.jpg')
+
+    images._optimize_image(  # pylint: disable=protected-access
+        source_path, output_path, 'JPEG', images.ImageOptions(max_dimension=32))
+
+    with Image.open(output_path) as image:
+      self.assertEqual(image.size, (32, 24))
+      self.assertEqual(image.info.get('icc_profile'), profile)
+
+
+if __name__ == '__main__':
+  unittest.main()